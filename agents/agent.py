@@ -18,6 +18,7 @@ import netifaces
 import shutil
 import ipaddress
 import subprocess
+import hashlib
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -66,6 +67,16 @@ def setup_local_db():
     )
     """)
     
+    # Último snapshot de hardware confirmado pelo servidor (protocolo delta)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS snapshot_state (
+        device_id TEXT PRIMARY KEY,
+        version INTEGER,
+        section_hashes TEXT,
+        timestamp TEXT
+    )
+    """)
+
     # Tabela para armazenar histórico de alterações
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS inventory_changes (
@@ -713,12 +724,11 @@ def sync_local_data():
         except Exception as e:
             logger.error(f"Error syncing inventory data for device {device_id}: {e}")
     
-    # Sincronizar alterações (se houver endpoint para isso)
+    # Alterações locais não são enviadas: o servidor gera o histórico comparando
+    # os inventários sincronizados acima com o estado que já tem armazenado
     for record in change_records:
         record_id, device_id, component, old_value, new_value, timestamp = record
         try:
-            # Aqui você implementaria a lógica para enviar as alterações para o servidor
-            # Por enquanto, vamos apenas marcar como sincronizado
             success_changes.append(record_id)
             logger.info(f"Successfully synced change record for device {device_id}")
         except Exception as e:
@@ -738,8 +748,8 @@ def sync_local_data():
     return len(success_inventory) + len(success_changes)
 
 # --- Main Agent Logic --- 
-def report_data(data):
-    """Sends collected data to the backend API."""
+def post_report(data):
+    """Posts one inventory payload to the backend API. Returns the response, or None on network errors."""
     headers = {
         'Content-Type': 'application/json',
         'Authorization': f'Bearer {API_TOKEN}' if API_TOKEN else ''
@@ -747,16 +757,99 @@ def report_data(data):
     api_url = f"{API_ENDPOINT}/devices/"
     try:
         logger.debug(f"Payload enviado:{json.dumps(data, indent=2)}")
-        response = requests.post(api_url, headers=headers, data=json.dumps(data), timeout=15)
+        return requests.post(api_url, headers=headers, data=json.dumps(data), timeout=15)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error reporting data to {api_url}: {e}")
+        logger.error(f"Please check if the API server is running at {API_ENDPOINT}")
+        return None
+
+def report_data(data):
+    """Sends collected data to the backend API."""
+    response = post_report(data)
+    if response is None:
+        return False
+    try:
         response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
         #logger.info(f"Successfully reported data for {data.get(\'ip_address\', \'unknown IP\')}. Status: {response.status_code}")
         logger.info(f"Successfully reported data for {data.get('ip_address', 'unknown IP')}. Status: {response.status_code}")                                              
         return True
     except requests.exceptions.RequestException as e:
-        logger.error(f"Error reporting data to {api_url}: {e}")
-        logger.error(f"Please check if the API server is running at {API_ENDPOINT}")
+        logger.error(f"Error reporting data to {API_ENDPOINT}/devices/: {e}")
         return False
 
+# --- Delta Protocol ---
+def section_hash(value):
+    """Hash estável do conteúdo de uma seção de hardware."""
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+def load_snapshot_state(device_id):
+    """Retorna (versão, hashes por seção) do último snapshot confirmado pelo servidor, ou None."""
+    conn = sqlite3.connect(DB_PATH)
+    row = conn.execute("SELECT version, section_hashes FROM snapshot_state WHERE device_id = ?", (device_id,)).fetchone()
+    conn.close()
+    if not row:
+        return None
+    return row[0], json.loads(row[1])
+
+def save_snapshot_state(device_id, version, hashes):
+    """Guarda a versão de snapshot confirmada; version=None apaga o estado (próximo envio será completo)."""
+    conn = sqlite3.connect(DB_PATH)
+    if version is None:
+        conn.execute("DELETE FROM snapshot_state WHERE device_id = ?", (device_id,))
+    else:
+        conn.execute(
+            "INSERT OR REPLACE INTO snapshot_state (device_id, version, section_hashes, timestamp) VALUES (?, ?, ?, ?)",
+            (device_id, version, json.dumps(hashes), datetime.datetime.now().isoformat())
+        )
+    conn.commit()
+    conn.close()
+
+def report_inventory(device_id, payload):
+    """Envia o inventário usando o protocolo delta.
+
+    Se o servidor já confirmou um snapshot deste dispositivo, envia apenas as seções de
+    hardware alteradas junto com base_snapshot_version. Se o servidor responder 409
+    (snapshot desatualizado), reenvia o inventário completo.
+    """
+    hardware = payload.get("hardware_details") or {}
+    hashes = {section: section_hash(value) for section, value in hardware.items()}
+    state = load_snapshot_state(device_id)
+
+    response = None
+    if state:
+        base_version, acked_hashes = state
+        delta = dict(payload)
+        delta["hardware_details"] = {s: v for s, v in hardware.items() if acked_hashes.get(s) != hashes[s]}
+        delta["base_snapshot_version"] = base_version
+        logger.info(f"Sending delta report ({len(delta['hardware_details'])} of {len(hardware)} sections changed)")
+        response = post_report(delta)
+        if response is not None and response.status_code == 409:
+            logger.info("Server requested a full resend (stale snapshot)")
+            response = None
+        elif response is None:
+            return False
+
+    if response is None:
+        response = post_report(payload)
+        if response is None:
+            return False
+
+    if not response.ok:
+        logger.error(f"Error reporting data: status {response.status_code} - {response.text[:200]}")
+        save_snapshot_state(device_id, None, None)
+        return False
+
+    # 201 traz o dispositivo gravado com a versão do snapshot; 202 (fila assíncrona) não confirma nada
+    version = None
+    try:
+        version = ((response.json() or {}).get("hardware_details") or {}).get("snapshot_version")
+    except ValueError:
+        pass
+    save_snapshot_state(device_id, version, hashes)
+    logger.info(f"Successfully reported data for {payload.get('ip_address', 'unknown IP')}. Status: {response.status_code}")
+    return True
+
 def get_machine_id():
     """Gera um ID único para a máquina baseado em hardware."""
     try:
@@ -844,12 +937,15 @@ def run_agent():
         "network_info": local_details.get("network_info"),
         "temperature_info": local_details.get("temperature_info"),
         "power_supply_info": local_details.get("power_supply_info"),
-        "custom_notes": local_details.get("custom_notes")
+        "custom_notes": local_details.get("custom_notes"),
+        "installed_software": local_details.get("installed_software"),
+        "usb_devices": local_details.get("usb_devices")
     }
 
     payload = {
         "ip_address": local_ip,
         "mac_address": local_mac,
+        "machine_id": machine_id,
         "name": platform.node(),
         "os": local_details.get("os", platform.system()),
         "device_type": "computer",
@@ -865,8 +961,8 @@ def run_agent():
         # Armazenar dados localmente
         store_data_locally(machine_id, payload)
     else:
-        # Enviar dados diretamente para o servidor
-        success = report_data(payload)
+        # Enviar dados diretamente para o servidor (apenas as seções alteradas, quando possível)
+        success = report_inventory(machine_id, payload)
         if not success and not args.offline:
             # Se falhar e não estiver explicitamente em modo offline, armazenar localmente
             logger.info("Failed to report data to server, storing locally...")
@@ -0,0 +1,66 @@
+"""AsyncSession counterparts of the crud functions behind the devices router (DB_ASYNC=true).
+
+The hot reads are native async queries. Writes run the sync crud functions, so
+they keep the same code, savepoints and change journaling:
+
+* on PostgreSQL through ``AsyncSession.run_sync``, every round trip awaiting
+  on the event loop instead of blocking a threadpool thread;
+* on SQLite in the threadpool, on a sync session. aiosqlite hands each
+  statement to a thread of its own and back, so a write transaction would wait
+  for dozens of event loop turns while holding the single writer connection;
+  under agent load with dashboards reading, ingest throughput fell from ~100 to
+  ~4 reports/s that way.
+
+Functions return rendered response bodies or plain values rather than ORM
+objects, because lazy loading is not available outside ``run_sync``.
+"""
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+import crud, database, models, schemas
+
+
+async def _write(db: AsyncSession, fn, *args):
+    """Runs ``fn(sync_session, *args)`` in one transaction, as described in the module docstring."""
+    if database.get_async_engine().dialect.name != "sqlite":
+        return await db.run_sync(fn, *args)
+
+    def call():
+        with database.SessionLocal() as sync_db:
+            return fn(sync_db, *args)
+
+    return await run_in_threadpool(call)
+
+
+async def get_device_version(db: AsyncSession, device_id: int):
+    """Primary-key lookup of a device's ``(version, last_seen)``, without touching its hardware."""
+    return (await db.execute(
+        select(models.Device.version, models.Device.last_seen).where(models.Device.id == device_id)
+    )).first()
+
+
+async def get_device_snapshot(db: AsyncSession, device_id: int, version: int) -> Optional[bytes]:
+    """Pre-rendered detail body of a device at ``version``; see crud.get_device_snapshot."""
+    body = (await db.execute(
+        select(models.DeviceSnapshot.body)
+        .where(models.DeviceSnapshot.device_id == device_id, models.DeviceSnapshot.version == version)
+    )).scalar()
+    if body is None:
+        body = await db.run_sync(crud.get_device_snapshot, device_id, version)
+    return body
+
+
+async def create_or_update_device(db: AsyncSession, device: schemas.DeviceCreate) -> bytes:
+    return await _write(db, crud.create_or_update_device, device)
+
+
+async def update_device_manual(db: AsyncSession, device_id: int,
+                               device_update: schemas.DeviceUpdate) -> Optional[bytes]:
+    return await _write(db, crud.update_device_manual, device_id, device_update)
+
+
+async def delete_device(db: AsyncSession, device_id: int) -> bool:
+    return await _write(db, crud.delete_device, device_id)
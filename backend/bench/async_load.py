@@ -0,0 +1,172 @@
+"""Load test of the sync and async (DB_ASYNC=true) devices router at 2k agents.
+
+Starts one uvicorn worker on a throwaway SQLite database, registers one device
+per agent, then holds CONNECTIONS keep-alive HTTP/1.1 connections open and runs
+them in a closed loop for DURATION seconds:
+
+    agents   every connection posts its agent report (POST /devices/); one in
+             ten reports changes the RAM size, the rest are heartbeats
+    mixed    the agents plus READERS dashboard connections reading device
+             details (GET /devices/{id})
+    readers  every connection reads device details
+
+For each request class it prints the sustained rate of successful requests and
+their p50/p99 latency, plus the count of every status code (and of requests
+still unanswered after REQUEST_TIMEOUT seconds).
+
+    cd backend
+    python bench/async_load.py sync mixed
+    python bench/async_load.py async mixed --connections 2000 --readers 50 --duration 20
+
+The client is a minimal asyncio HTTP/1.1 client; thousands of httpx clients
+would cost more CPU than the server under test. Raise the open file limit
+(ulimit -n 8192) before running 2000 connections.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def report(i: int, run: int) -> dict:
+    """Agent report of device ``i``; every tenth run changes its hardware."""
+    return {
+        "name": f"pc-{i}",
+        "ip_address": f"10.{i // 65536}.{i // 256 % 256}.{i % 256}",
+        "mac_address": f"aa:bb:cc:{i // 65536:02x}:{i // 256 % 256:02x}:{i % 256:02x}",
+        "os": "Windows 11",
+        "hardware_details": {
+            "cpu_info": {"model": "Intel Core i5-1235U", "cores": 10},
+            "ram_info": {"total_gb": 16 + (run % 2 if run % 10 == 0 else 0)},
+            "disk_info": [{"device": "sda", "total_gb": 500, "free_gb": 200}],
+            "installed_software": [{"name": f"app{k}", "version": "1.0"} for k in range(20)],
+        },
+    }
+
+
+async def http(reader, writer, method: str, path: str, body: bytes = b"") -> int:
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+    status_line = await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":")[1])
+    if length:
+        await reader.readexactly(length)
+    return int(status_line.split()[1])
+
+
+class Latencies:
+    def __init__(self):
+        self.ok = []
+        self.codes = Counter()
+
+    def add(self, code, seconds: Optional[float] = None):
+        self.codes[code] += 1
+        if seconds is not None and code in (200, 201):
+            self.ok.append(seconds)
+
+    def summary(self, duration: float) -> str:
+        ok = sorted(self.ok)
+
+        def percentile(p):
+            return ok[min(len(ok) - 1, int(len(ok) * p))] * 1000 if ok else float("nan")
+
+        codes = ", ".join(f"{code}: {count}" for code, count in sorted(self.codes.items(), key=str))
+        return (f"{len(ok) / duration:7.1f} ok req/s, p50 {percentile(.50):7.0f} ms, "
+                f"p99 {percentile(.99):7.0f} ms ({codes})")
+
+
+async def run_load(args, port: int) -> dict:
+    import httpx
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=300) as client:
+        ids = [(await client.post("/devices/", json=report(i, 1))).json()["id"] for i in range(args.connections)]
+
+    started = asyncio.Event()
+    deadline = []
+    results = {"POST": Latencies(), "GET": Latencies()}
+
+    async def connection(i: int, kind: str):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=1 << 20)
+        await started.wait()
+        run = 0
+        while time.perf_counter() < deadline[0]:
+            run += 1
+            request_started = time.perf_counter()
+            try:
+                if kind == "POST":
+                    request = http(reader, writer, "POST", "/devices/", json.dumps(report(i, run)).encode())
+                else:
+                    request = http(reader, writer, "GET", f"/devices/{ids[(i * 7 + run) % len(ids)]}")
+                code = await asyncio.wait_for(request, args.request_timeout)
+            except asyncio.TimeoutError:
+                results[kind].add("timeout")
+                break
+            if time.perf_counter() <= deadline[0]:
+                results[kind].add(code, time.perf_counter() - request_started)
+        writer.close()
+
+    if args.scenario == "readers":
+        kinds = ["GET"] * args.connections
+    else:
+        kinds = ["POST"] * args.connections + (["GET"] * args.readers if args.scenario == "mixed" else [])
+    tasks = [asyncio.create_task(connection(i, kind)) for i, kind in enumerate(kinds)]
+    # Let every connection open before the clock starts
+    await asyncio.sleep(3)
+    deadline.append(time.perf_counter() + args.duration)
+    started.set()
+    await asyncio.wait(tasks, timeout=args.duration + args.request_timeout + 10)
+    return {kind: latencies for kind, latencies in results.items() if latencies.codes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("mode", choices=["sync", "async"])
+    parser.add_argument("scenario", choices=["agents", "mixed", "readers"])
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--readers", type=int, default=50, help="dashboard connections in the mixed scenario")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--request-timeout", type=float, default=60)
+    parser.add_argument("--port", type=int, default=8770)
+    args = parser.parse_args()
+
+    import httpx
+
+    database_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{database_path}", DB_ASYNC=str(args.mode == "async").lower())
+    subprocess.run([sys.executable, "migrate.py"], cwd=BACKEND_DIR, env=env, check=True, capture_output=True)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "critical", "--backlog", "4096"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    try:
+        while True:
+            try:
+                if httpx.get(f"http://127.0.0.1:{args.port}/readyz").status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            time.sleep(0.1)
+        results = asyncio.run(run_load(args, args.port))
+    finally:
+        server.kill()
+        server.wait()
+    for kind, latencies in results.items():
+        print(f"{args.mode:5} {args.scenario:7} {kind:4} {latencies.summary(args.duration)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Benchmark of FAST_JSON on 1000-device list responses and detail snapshots.
+
+Loads 1000 devices with realistic hardware sections into a throwaway SQLite
+database, then times the default (pydantic model_validate + model_dump_json)
+and fast (serialization.py) renderings of the same rows, plus the whole
+GET /devices/?limit=1000&include=hardware request with the query cache off.
+Also reports whether both paths produce the same document and the same bytes.
+
+    cd backend
+    python bench/json_serialization.py [--devices 1000] [--rounds 20]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def hardware(i: int) -> dict:
+    return {
+        "cpu_info": {"model": "Intel Core i7-12700", "cores": 12, "threads": 20, "frequency_mhz": 3600.5},
+        "ram_info": {"total_gb": 32, "used_gb": 12.4, "modules": [{"capacity_gb": 16, "speed_mhz": 3200}] * 2},
+        "disk_info": [{"device": f"/dev/sd{'abcd'[k]}", "mountpoint": f"/m{k}", "total_gb": 512,
+                       "free_gb": 100.5 + i % 7, "fstype": "ext4"} for k in range(4)],
+        "network_info": [{"name": "eth0", "mac_address": f"aa:bb:cc:00:{i >> 8:02x}:{i & 255:02x}"}],
+        "gpu_info": {"model": "RTX 3060", "vram_mb": 8192},
+        "temperature_info": {"cpu": 55.5},
+    }
+
+
+def timed(function, rounds: int) -> float:
+    """Median milliseconds of ``function`` over ``rounds`` runs, after one warm-up run."""
+    function()
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ["QUERY_CACHE_SIZE"] = "0"
+    from fastapi.testclient import TestClient
+
+    import crud, database, main as app_main, migrate, schemas, serialization
+
+    migrate.migrate()
+    client = TestClient(app_main.app)
+    lines = "\n".join(json.dumps({"name": f"pc-{i}", "ip_address": f"10.0.{i >> 8}.{i & 255}", "hardware_details": hardware(i)})
+                      for i in range(args.devices))
+    client.post("/devices/bulk", content=lines, headers={"Content-Type": "application/x-ndjson"})
+
+    db = database.SessionLocal()
+    devices, _ = crud.get_devices_page(db, {}, limit=args.devices, with_hardware=True)
+    history = crud.get_recent_history(db, [d.id for d in devices], 10)
+
+    def default_page():
+        items = []
+        for db_device in devices:
+            item = schemas.DeviceListItem.model_validate(db_device)
+            item.recent_history = [schemas.HistoryLog.model_validate(log) for log in history[db_device.id]]
+            items.append(item)
+        return schemas.DevicePage(items=items).model_dump_json().encode()
+
+    def fast_page():
+        return serialization.device_page(devices, history, None, None, None)
+
+    default_body, fast_body = default_page(), fast_page()
+    print(f"{len(devices)} devices, page body {len(default_body) / 1024:.0f} KiB")
+    print(f"  same document: {json.loads(default_body) == json.loads(fast_body)}, "
+          f"same bytes: {default_body == fast_body}")
+    print(f"page serialization, default:               {timed(default_page, args.rounds):7.1f} ms")
+    encoder = "orjson" if serialization.orjson is not None else "pydantic-core"
+    print(f"page serialization, fast ({encoder}):{' ' * (14 - len(encoder))}{timed(fast_page, args.rounds):7.1f} ms")
+    if serialization.orjson is not None:
+        orjson, serialization.orjson = serialization.orjson, None
+        print(f"page serialization, fast (pydantic-core):  {timed(fast_page, args.rounds):7.1f} ms")
+        serialization.orjson = orjson
+
+    for fast in (False, True):
+        serialization.FAST_JSON = fast
+        request = lambda: client.get("/devices/", params={"limit": args.devices, "include": "hardware"}).content
+        print(f"GET /devices/ include=hardware, FAST_JSON={str(fast).lower():5}: {timed(request, max(args.rounds // 2, 1)):7.1f} ms")
+
+    serialization.FAST_JSON = True
+    fast_detail = crud.render_device(db, devices[0].id)[1]
+    serialization.FAST_JSON = False
+    default_detail = crud.render_device(db, devices[0].id)[1]
+    print(f"detail snapshot: same document: {json.loads(default_detail) == json.loads(fast_detail)}, "
+          f"same bytes: {default_detail == fast_detail}")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import os
+import threading
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Put in a subscriber's queue when it fell behind; the stream then tells the
+# client to resynchronize and ends
+DROPPED = object()
+
+
+class Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = False
+
+
+class BroadcastHub:
+    """Bounded in-process fan-out of device change events to GET /devices/stream clients.
+
+    Writers call ``publish`` from any thread after committing. Each client has
+    its own bounded queue; a client that lets it fill up is dropped instead of
+    slowing down writers or buffering without limit. With no clients connected
+    publishing is a no-op, and an idle fleet sends nothing but keepalives.
+    Events only reach clients of the worker process that made the write; use
+    GET /changes to follow every worker.
+    """
+
+    def __init__(self, max_subscribers: int = 1000, queue_size: int = 100):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self._subscribers: List[Subscriber] = []
+        self._lock = threading.Lock()
+        self._stats = {"published": 0, "delivered": 0, "dropped_clients": 0, "rejected_clients": 0}
+
+    def subscribe(self) -> Optional[Subscriber]:
+        """Registers a client of the running event loop; None when the hub is full."""
+        subscriber = Subscriber(asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                self._stats["rejected_clients"] += 1
+                return None
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def publish(self, events: List[dict]):
+        if not events:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self._stats["published"] += len(events)
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(self._offer, subscriber, events)
+            except RuntimeError:
+                # The client's event loop is gone
+                self.unsubscribe(subscriber)
+
+    def _offer(self, subscriber: Subscriber, events: List[dict]):
+        # Runs on the subscriber's event loop
+        if subscriber.dropped:
+            return
+        for event in events:
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+                return
+        with self._lock:
+            self._stats["delivered"] += len(events)
+
+    def _drop(self, subscriber: Subscriber):
+        subscriber.dropped = True
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(DROPPED)
+        self.unsubscribe(subscriber)
+        with self._lock:
+            self._stats["dropped_clients"] += 1
+        logger.info("Dropped a device stream client that fell %s events behind", self.queue_size)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["clients"] = len(self._subscribers)
+        stats.update(max_clients=self.max_subscribers, client_queue_size=self.queue_size)
+        return stats
+
+
+hub = BroadcastHub(
+    max_subscribers=int(os.getenv("STREAM_MAX_CLIENTS", "1000")),
+    queue_size=int(os.getenv("STREAM_CLIENT_QUEUE_SIZE", "100")),
+)
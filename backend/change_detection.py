@@ -0,0 +1,86 @@
+import json
+from typing import Callable, Dict, List, Optional, Tuple
+
+# How list sections identify "the same" item between two reports
+LIST_KEYS: Dict[str, Callable[[dict], Optional[str]]] = {
+    "disk_info": lambda disk: disk.get("name") or disk.get("mountpoint"),
+    "network_info": lambda nic: nic.get("mac") or nic.get("name"),
+}
+
+# Labels used in change descriptions
+SECTION_LABELS = {
+    "cpu_info": "CPU",
+    "ram_info": "RAM",
+    "disk_info": "Disk",
+    "gpu_info": "GPU",
+    "motherboard_info": "Motherboard",
+    "network_info": "Network interface",
+    "temperature_info": "Temperatures",
+    "power_supply_info": "Power supply",
+    "custom_notes": "Notes",
+    "installed_software": "Software",
+    "usb_devices": "USB device",
+}
+
+
+def _dump(value) -> Optional[str]:
+    if value is None:
+        return None
+    return value if isinstance(value, str) else json.dumps(value, sort_keys=True, default=str)
+
+
+def _change(section: str, description: str, before=None, after=None) -> dict:
+    return {
+        "component": section,
+        "change_description": description,
+        "details_before": _dump(before),
+        "details_after": _dump(after),
+    }
+
+
+def diff_keyed_list(section: str, before: Optional[list], after: Optional[list]) -> List[dict]:
+    """Item-level diff of a list section, matching items by their LIST_KEYS key."""
+    key_of = LIST_KEYS[section]
+    label = SECTION_LABELS[section]
+    old_items = {key_of(item): item for item in before or [] if isinstance(item, dict)}
+    new_items = {key_of(item): item for item in after or [] if isinstance(item, dict)}
+    changes = []
+    for key in sorted(old_items.keys() - new_items.keys(), key=str):
+        changes.append(_change(section, f"{label} {key} removed", before=old_items[key]))
+    for key in sorted(new_items.keys() - old_items.keys(), key=str):
+        changes.append(_change(section, f"{label} {key} added", after=new_items[key]))
+    for key in sorted(old_items.keys() & new_items.keys(), key=str):
+        if old_items[key] != new_items[key]:
+            changes.append(_change(section, f"{label} {key} changed", before=old_items[key], after=new_items[key]))
+    return changes
+
+
+def diff_section(section: str, before, after) -> List[dict]:
+    """History entries for one hardware_details column whose content changed."""
+    if section in LIST_KEYS:
+        return diff_keyed_list(section, before, after)
+    return [_change(section, f"{SECTION_LABELS.get(section, section)} changed", before=before, after=after)]
+
+
+def diff_child_rows(section: str, columns: Tuple[str, ...], added: List[Tuple], removed: List[Tuple]) -> List[dict]:
+    """History entries for a child-table section from the rows a sync added and removed.
+
+    Rows are matched by name, so a package whose version moved is one "updated"
+    entry instead of a removal plus an installation.
+    """
+    label = SECTION_LABELS[section]
+    old_rows = {row[0]: dict(zip(columns, row)) for row in removed}
+    new_rows = {row[0]: dict(zip(columns, row)) for row in added}
+    changes = []
+    for name in sorted(old_rows.keys() - new_rows.keys()):
+        changes.append(_change(section, f"{label} {name} removed", before=old_rows[name]))
+    for name in sorted(new_rows.keys() - old_rows.keys()):
+        changes.append(_change(section, f"{label} {name} added", after=new_rows[name]))
+    for name in sorted(old_rows.keys() & new_rows.keys()):
+        old_version, new_version = old_rows[name].get("version"), new_rows[name].get("version")
+        if old_version != new_version:
+            description = f"{label} {name} updated from {old_version} to {new_version}"
+        else:
+            description = f"{label} {name} changed"
+        changes.append(_change(section, description, before=old_rows[name], after=new_rows[name]))
+    return changes
@@ -1,8 +1,18 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, case, column, delete, func, insert, inspect, literal_column, or_, select, table, text, tuple_, update
+from sqlalchemy.orm import Session, raiseload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.exc import IntegrityError
-import models, schemas
+from sqlalchemy.dialects import postgresql, sqlite
+import broadcast, change_detection, fleet_stats, hardware_attributes, models, schemas, search_index, serialization
+from identity_map import IDENTITY_KEYS, identity_map
+from pagination import escape_like
+from query_cache import invalidate_devices
+from collections import Counter
 from datetime import datetime
-from typing import Optional
+import hashlib
+import json
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
 
 def get_device_by_id(db: Session, device_id: int):
     return db.query(models.Device).filter(models.Device.id == device_id).first()
@@ -16,79 +26,972 @@ def get_device_by_ip_or_mac(db: Session, ip_address: str, mac_address: Optional[
         device = db.query(models.Device).filter(models.Device.mac_address == mac_address).first()
     return device
 
-def get_devices(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Device).offset(skip).limit(limit).all()
+# History entries embedded in a device detail response; older ones are read via
+# GET /devices/{id}/history
+DETAIL_HISTORY_LIMIT = 20
 
-def create_or_update_device(db: Session, device: schemas.DeviceCreate):
-    """Creates a new device or updates an existing one based on IP or MAC address."""
-    db_device = get_device_by_ip_or_mac(db, device.ip_address, device.mac_address)
+def get_device_version(db: Session, device_id: int):
+    """Primary-key lookup of a device's ``(version, last_seen)``, without touching its hardware."""
+    return db.execute(
+        select(models.Device.version, models.Device.last_seen).where(models.Device.id == device_id)
+    ).first()
 
-    if db_device:
-        # Update existing device
-        update_data = device.model_dump(exclude_unset=True)
-        for key, value in update_data.items():
-            if key == "hardware_details" and value is not None:
-                if db_device.hardware_details:
-                    for hw_key, hw_value in value.items():
-                        setattr(db_device.hardware_details, hw_key, hw_value)
-                else:
-                    db_hardware = models.HardwareDetail(**value, device_id=db_device.id)
-                    db.add(db_hardware)
-                    db_device.hardware_details = db_hardware
-            elif hasattr(db_device, key):
-                setattr(db_device, key, value)
-        db_device.last_seen = datetime.now()
+def render_device(db: Session, device_id: int) -> Optional[Tuple[models.Device, bytes]]:
+    """Renders the GET /devices/{id} body from the current (possibly uncommitted) state."""
+    db.flush()
+    db_device = (
+        db.query(models.Device)
+        .options(selectinload(models.Device.hardware_details), raiseload(models.Device.history_logs))
+        .populate_existing()
+        .filter(models.Device.id == device_id)
+        .first()
+    )
+    if db_device is None:
+        return None
+    recent = get_recent_history(db, [device_id], DETAIL_HISTORY_LIMIT)[device_id]
+    set_committed_value(db_device, "history_logs", recent)
+    if serialization.FAST_JSON:
+        return db_device, serialization.device_detail(db_device)
+    return db_device, schemas.Device.model_validate(db_device).model_dump_json().encode()
+
+def _outdated_devices(db: Session, device_ids: List[int]):
+    """``(id, version, snapshot version, snapshot stats)`` of the given devices whose version moved past their snapshot."""
+    return db.execute(
+        select(models.Device.id, models.Device.version, models.DeviceSnapshot.version.label("snapshot_version"),
+               models.DeviceSnapshot.stats)
+        .outerjoin(models.DeviceSnapshot, models.DeviceSnapshot.device_id == models.Device.id)
+        .where(models.Device.id.in_(device_ids))
+        .where(or_(models.DeviceSnapshot.version.is_(None), models.DeviceSnapshot.version != models.Device.version))
+    ).all()
+
+def _store_snapshot(db: Session, device_id: int, previous_stats: Optional[dict]) -> Tuple[models.Device, bytes]:
+    """Re-renders a device snapshot and moves the fleet counters by the device's new contribution."""
+    db_device, body = render_device(db, device_id)
+    stats = fleet_stats.contribution(db_device, db_device.hardware_details)
+    stmt = _insert(db, models.DeviceSnapshot).values(
+        device_id=device_id, version=db_device.version, body=body, stats=stats
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["device_id"],
+        set_={"version": stmt.excluded.version, "body": stmt.excluded.body, "stats": stmt.excluded.stats},
+    ))
+    _add_fleet_stats(db, fleet_stats.delta(previous_stats, stats))
+    _store_search_document(db, db_device)
+    return db_device, body
+
+def _store_search_document(db: Session, db_device: models.Device):
+    """Re-renders a device's search document; the row (and so the text index) is only written if it changed."""
+    names = search_index.software_names(db, [db_device.id])[db_device.id]
+    stmt = _insert(db, models.DeviceSearch).values(
+        device_id=db_device.id, document=search_index.document(db_device, db_device.hardware_details, names)
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["device_id"],
+        set_={"document": stmt.excluded.document},
+        where=models.DeviceSearch.document != stmt.excluded.document,
+    ))
+
+def search_devices(db: Session, phrases, ranked: bool = True, limit: int = 20) -> List[models.Device]:
+    """Devices whose search document matches every phrase (see search_index.parse_query).
+
+    Ranked searches order matches by relevance, which scores every match;
+    unranked ones (prefix mode) stop at the first ``limit`` matches.
+    """
+    dialect = db.get_bind().dialect.name
+    expression = search_index.match_expression(dialect, phrases)
+    query = select(models.Device).options(raiseload(models.Device.history_logs))
+    if dialect == "postgresql":
+        config = literal_column("'simple'")
+        # Same expression as the ix_device_search_tsv index
+        vector = func.to_tsvector(config, models.DeviceSearch.document)
+        tsquery = func.to_tsquery(config, expression)
+        query = query.join(models.DeviceSearch, models.DeviceSearch.device_id == models.Device.id).where(vector.op("@@")(tsquery))
+        if ranked:
+            query = query.order_by(func.ts_rank(vector, tsquery).desc())
     else:
-        # Create new device
-        hardware_data = device.hardware_details
-        device_data = device.model_dump(exclude={"hardware_details"})
-        db_device = models.Device(**device_data)
-        db.add(db_device)
-        db.flush()  # To get db_device.id
+        fts = table("device_search_fts", column("rowid"), column("rank"))
+        query = query.join(fts, fts.c.rowid == models.Device.id).where(literal_column("device_search_fts").op("MATCH")(expression))
+        if ranked:
+            query = query.order_by(fts.c.rank)
+    return db.execute(query.limit(limit)).scalars().all()
 
-        if hardware_data:
-            db_hardware = models.HardwareDetail(**hardware_data.model_dump(), device_id=db_device.id)
-            db.add(db_hardware)
+def _add_fleet_stats(db: Session, deltas: dict):
+    if not deltas:
+        return
+    stmt = _insert(db, models.FleetStat).values(
+        [{"metric": metric, "key": key, "value": amount} for (metric, key), amount in sorted(deltas.items())]
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["metric", "key"], set_={"value": models.FleetStat.value + stmt.excluded.value}
+    ))
 
-    try:
-        db.commit()
-        db.refresh(db_device)
-    except IntegrityError:
-        db.rollback()
-        raise
-    return db_device
+def get_fleet_stats(db: Session) -> List[Tuple[str, str, float]]:
+    return db.execute(select(models.FleetStat.metric, models.FleetStat.key, models.FleetStat.value)).all()
 
-def update_device_manual(db: Session, device_id: int, device_update: schemas.DeviceUpdate):
-    db_device = get_device_by_id(db, device_id=device_id)
-    if not db_device:
-        return None
+def rebuild_fleet_stats(db: Session, batch_size: int = 1000) -> int:
+    """Recomputes fleet_stats and every snapshot's contribution from the devices themselves.
+
+    Repairs counters that drifted (e.g. after manual SQL). Commits; returns the number of devices.
+    """
+    totals, count = Counter(), 0
+    devices = db.execute(
+        select(models.Device).options(selectinload(models.Device.hardware_details), raiseload(models.Device.history_logs))
+        .order_by(models.Device.id)
+        .execution_options(yield_per=batch_size)
+    ).scalars()
+    missing = []
+    for partition in devices.partitions():
+        for db_device in partition:
+            stats = fleet_stats.contribution(db_device, db_device.hardware_details)
+            totals.update(stats)
+            count += 1
+            updated = db.execute(
+                update(models.DeviceSnapshot).where(models.DeviceSnapshot.device_id == db_device.id).values(stats=stats)
+            )
+            if updated.rowcount == 0:
+                missing.append(db_device.id)
+    db.execute(delete(models.FleetStat))
+    _add_fleet_stats(db, fleet_stats.delta(None, totals))
+    # Devices without a snapshot get one; they are counted above, so start them from their own stats
+    for device_id in missing:
+        db_device, body = render_device(db, device_id)
+        db.execute(insert(models.DeviceSnapshot).values(
+            device_id=device_id, version=db_device.version, body=body,
+            stats=fleet_stats.contribution(db_device, db_device.hardware_details),
+        ))
+    db.commit()
+    return count
+
+# Session.info key collecting what the current transaction changed, per device
+PENDING_CHANGES = "pending_device_changes"
+
+def _note_change(db: Session, device_id: int, created: bool = False, sections=(), fields_version: Optional[int] = None):
+    pending = db.info.setdefault(PENDING_CHANGES, {})
+    change = pending.setdefault(device_id, {"created": False, "sections": set(), "fields_version": None})
+    change["created"] |= created
+    change["sections"].update(sections)
+    if fields_version is not None:
+        change["fields_version"] = fields_version
+
+def discard_pending_changes(db: Session):
+    db.info.pop(PENDING_CHANGES, None)
+
+def record_device_changes(db: Session, device_ids: List[int], bodies: Optional[dict] = None) -> List[dict]:
+    """Journals and re-renders every given device whose version moved in this transaction,
+    and every other device the transaction noted a change of (see release_identities).
+
+    Runs right before commit, so the change_journal rows and the new snapshots are
+    committed together with the change they describe. Does not commit; returns
+    the events to hand to publish_changes once the commit succeeded. The new
+    snapshot bodies are stored in ``bodies`` by device id when it is given.
+    """
+    pending = db.info.pop(PENDING_CHANGES, {})
+    device_ids = list(dict.fromkeys([*device_ids, *pending]))
+    db.flush()
+    outdated = _outdated_devices(db, device_ids)
+    if not outdated:
+        return []
+    events, published = [], []
+    for row in outdated:
+        change = pending.get(row.id, {"created": False, "sections": set(), "fields_version": None})
+        sections = sorted(change["sections"] - {"device"})
+        fields_version = change["fields_version"]
+        # The upsert moves the version only when a device field differs
+        fields_changed = fields_version is not None and (row.snapshot_version is None or fields_version > row.snapshot_version)
+        if not change["created"] and ("device" in change["sections"] or fields_changed):
+            sections.insert(0, "device")
+        event = {
+            "device_id": row.id,
+            "operation": "create" if change["created"] else "update",
+            "sections": sections,
+            "version": row.version,
+        }
+        db_device, body = _store_snapshot(db, row.id, row.stats)
+        if bodies is not None:
+            bodies[row.id] = body
+        events.append(event)
+        published.append({**event, "device": schemas.DeviceSummary.model_validate(db_device).model_dump(mode="json")})
+    _journal(db, events)
+    return published
+
+def publish_changes(device_ids, events: List[dict]):
+    """Tells the read cache and live stream clients about committed changes."""
+    invalidate_devices({*device_ids, *(event["device_id"] for event in events)})
+    broadcast.hub.publish(events)
+
+def _journal(db: Session, events: List[dict]):
+    if db.get_bind().dialect.name == "postgresql":
+        # Serialize journal writers until commit so ids become visible in order and
+        # GET /changes readers never skip an id committed late
+        db.execute(text("SELECT pg_advisory_xact_lock(hashtext('change_journal'))"))
+    db.execute(insert(models.ChangeEvent), events)
+
+def get_changes(db: Session, since: int = 0, limit: int = 100) -> List[models.ChangeEvent]:
+    """Journal entries after the ``since`` event id, oldest first."""
+    return (
+        db.query(models.ChangeEvent)
+        .filter(models.ChangeEvent.id > since)
+        .order_by(models.ChangeEvent.id)
+        .limit(limit)
+        .all()
+    )
+
+def get_latest_change_id(db: Session) -> int:
+    return db.execute(select(func.max(models.ChangeEvent.id))).scalar() or 0
+
+def _device_body(db: Session, device_id: int, bodies: dict) -> bytes:
+    """Detail body of a device written in this transaction, after record_device_changes.
+
+    Either the snapshot it just rendered or, when the device's version did not
+    move (a heartbeat), its stored snapshot with the new last_seen.
+    """
+    if device_id in bodies:
+        return bodies[device_id]
+    row = db.execute(
+        select(models.DeviceSnapshot.body, models.Device.last_seen)
+        .join(models.Device, models.Device.id == models.DeviceSnapshot.device_id)
+        .where(models.DeviceSnapshot.device_id == device_id)
+    ).one()
+    return serialization.with_last_seen(row.body, row.last_seen)
 
-    update_data = device_update.model_dump(exclude_unset=True)
+def get_device_snapshot(db: Session, device_id: int, version: int) -> Optional[bytes]:
+    """Pre-rendered detail body of a device at ``version``.
 
+    A device without a snapshot at its version (written before snapshots existed,
+    e.g. on a database not migrated since) is rendered on the fly; reads never
+    write. Returns None if the device is no longer at ``version``.
+    """
+    body = db.execute(
+        select(models.DeviceSnapshot.body)
+        .where(models.DeviceSnapshot.device_id == device_id, models.DeviceSnapshot.version == version)
+    ).scalar()
+    if body is None:
+        rendered = render_device(db, device_id)
+        # Re-versioned or deleted since ``version`` was read: that body is gone
+        if rendered is not None and rendered[0].version == version:
+            body = rendered[1]
+    return body
+
+def get_history_page(db: Session, filters: dict, after: Optional[Tuple] = None, limit: int = 100,
+                     ascending: bool = False):
+    """History entries ordered by (timestamp, id), newest first unless ``ascending``.
+
+    ``filters`` may hold device_id, component, user, since (inclusive) and until
+    (exclusive). Keyset-paginated from the ``(timestamp, id)`` position ``after``;
+    returns up to ``limit + 1`` rows so the caller can tell whether more exist.
+    """
+    criteria = []
+    for field in ("device_id", "component", "user"):
+        if filters.get(field) is not None:
+            criteria.append(getattr(models.HistoryLog, field) == filters[field])
+    if filters.get("since") is not None:
+        criteria.append(models.HistoryLog.timestamp >= filters["since"])
+    if filters.get("until") is not None:
+        criteria.append(models.HistoryLog.timestamp < filters["until"])
+    if after is not None:
+        position = tuple_(models.HistoryLog.timestamp, models.HistoryLog.id)
+        criteria.append(position > tuple_(*after) if ascending else position < tuple_(*after))
+
+    direction = "asc" if ascending else "desc"
+    return (
+        db.query(models.HistoryLog)
+        .filter(*criteria)
+        .order_by(getattr(models.HistoryLog.timestamp, direction)(), getattr(models.HistoryLog.id, direction)())
+        .limit(limit + 1)
+        .all()
+    )
+
+# Sort keys accepted by get_devices_page; each is backed by a (key, id) index in models.Device
+DEVICE_SORT_KEYS = {
+    "id": models.Device.id,
+    "name": func.coalesce(models.Device.name, ""),
+    "ip_address": func.coalesce(models.Device.ip_address, ""),
+    "last_seen": models.Device.last_seen,
+    "created_at": models.Device.created_at,
+}
+
+# A hardware filter matching at least this many devices counts as broad: pages
+# then scan devices in order and probe each one's hardware row (see _hardware_criterion)
+HARDWARE_FILTER_PROBE = 5000
+
+def _hardware_criterion(db: Session, parsed_filters, paged: bool):
+    """Devices matching hardware_attributes filters, answered from the hardware_details indexes.
+
+    A selective filter is best read from its index and the matches sorted; a broad
+    one is best checked device by device in page order, stopping after one page.
+    PostgreSQL picks between the two from column statistics; SQLite does not, so
+    for pages a LIMITed count of the matches decides.
+    """
+    dialect = db.get_bind().dialect.name
+    hardware = models.HardwareDetail
+    conditions = [hardware_attributes.condition(hardware, dialect, parsed) for parsed in parsed_filters]
+    if paged and dialect == "sqlite":
+        probe = select(hardware.id).where(*conditions).limit(HARDWARE_FILTER_PROBE).subquery()
+        if db.execute(select(func.count()).select_from(probe)).scalar() >= HARDWARE_FILTER_PROBE:
+            return select(hardware.id).where(hardware.device_id == models.Device.id, *conditions).exists()
+    return models.Device.id.in_(select(hardware.device_id).where(*conditions))
+
+def _device_filters(db: Session, filters: dict, paged: bool = False) -> list:
+    criteria = []
+    for field in ("device_type", "status", "os"):
+        if filters.get(field) is not None:
+            criteria.append(getattr(models.Device, field) == filters[field])
+    if filters.get("name_prefix"):
+        criteria.append(models.Device.name.like(escape_like(filters["name_prefix"]) + "%", escape="\\"))
+    if filters.get("last_seen_after") is not None:
+        criteria.append(models.Device.last_seen >= filters["last_seen_after"])
+    if filters.get("last_seen_before") is not None:
+        criteria.append(models.Device.last_seen < filters["last_seen_before"])
+    if filters.get("hardware"):
+        criteria.append(_hardware_criterion(db, filters["hardware"], paged))
+    return criteria
+
+def get_devices_page(db: Session, filters: dict, sort: str = "id", descending: bool = False,
+                     after: Optional[Tuple] = None, backwards: bool = False, limit: int = 100,
+                     with_hardware: bool = False):
+    """Returns up to ``limit + 1`` devices following (or, if ``backwards``, preceding)
+    the ``(sort key, id)`` position ``after`` in the requested order.
+
+    Keyset pagination: every page is an index range scan starting at the cursor,
+    so deep pages cost the same as the first one. Returns ``(devices, has_more)``
+    with devices in display order; has_more tells whether the scan could go on.
+    """
+    sort_col = DEVICE_SORT_KEYS[sort]
+    scan_descending = descending != backwards
+    hardware_loader = selectinload if with_hardware else raiseload
+    query = (
+        db.query(models.Device)
+        .options(hardware_loader(models.Device.hardware_details), raiseload(models.Device.history_logs))
+        .filter(*_device_filters(db, filters, paged=True))
+    )
+    if after is not None:
+        position = tuple_(sort_col, models.Device.id)
+        bound = tuple_(*after)
+        # The redundant bound on the sort key alone lets SQLite seek the expression index too
+        if scan_descending:
+            query = query.filter(sort_col <= after[0], position < bound)
+        else:
+            query = query.filter(sort_col >= after[0], position > bound)
+    if scan_descending:
+        query = query.order_by(sort_col.desc(), models.Device.id.desc())
+    else:
+        query = query.order_by(sort_col.asc(), models.Device.id.asc())
+    rows = query.limit(limit + 1).all()
+    if not with_hardware:
+        _without_hardware(rows)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+    return rows, has_more
+
+def _without_hardware(devices: List[models.Device]):
+    """Marks the hardware of devices loaded with raiseload as absent, so responses render it as null."""
+    for db_device in devices:
+        if "hardware_details" in inspect(db_device).unloaded:
+            set_committed_value(db_device, "hardware_details", None)
+
+def device_sort_value(db_device: models.Device, sort: str):
+    if sort in ("name", "ip_address"):
+        return getattr(db_device, sort) or ""
+    return getattr(db_device, sort)
+
+# hardware_details columns carried by exports
+EXPORT_HARDWARE_COLUMNS = (
+    "cpu_info", "ram_info", "disk_info", "gpu_info", "motherboard_info",
+    "network_info", "temperature_info", "power_supply_info", "custom_notes",
+)
+
+def stream_device_export(db: Session, filters: dict, batch_size: int = 1000):
+    """Yields every matching device joined with its hardware, ``batch_size`` rows at a time.
+
+    Rows are plain mappings fetched through a server-side cursor (stream_results),
+    so memory stays flat however many devices there are.
+    """
+    hardware = [getattr(models.HardwareDetail, column) for column in EXPORT_HARDWARE_COLUMNS]
+    stmt = (
+        select(*models.Device.__table__.columns, *hardware)
+        .outerjoin(models.HardwareDetail, models.HardwareDetail.device_id == models.Device.id)
+        .where(*_device_filters(db, filters))
+        .order_by(models.Device.id)
+        .execution_options(stream_results=True, yield_per=batch_size)
+    )
+    for partition in db.execute(stmt).mappings().partitions():
+        yield partition
+
+def estimate_device_count(db: Session, filters: dict) -> int:
+    """Cheap row count: planner statistics on an unfiltered PostgreSQL table, COUNT(*) otherwise."""
+    criteria = _device_filters(db, filters)
+    if not criteria and db.get_bind().dialect.name == "postgresql":
+        estimate = db.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'devices'::regclass")
+        ).scalar()
+        if estimate is not None and estimate >= 0:
+            return estimate
+    return db.query(func.count(models.Device.id)).filter(*criteria).scalar()
+
+def get_recent_history(db: Session, device_ids: List[int], per_device: int) -> Dict[int, List[models.HistoryLog]]:
+    """Returns the latest ``per_device`` history entries of each device, in one query."""
+    if not device_ids:
+        return {}
+    ranked = (
+        select(
+            models.HistoryLog.id,
+            func.row_number()
+            .over(partition_by=models.HistoryLog.device_id, order_by=models.HistoryLog.timestamp.desc())
+            .label("rank"),
+        )
+        .where(models.HistoryLog.device_id.in_(device_ids))
+        .subquery()
+    )
+    rows = (
+        db.query(models.HistoryLog)
+        .join(ranked, ranked.c.id == models.HistoryLog.id)
+        .filter(ranked.c.rank <= per_device)
+        .order_by(models.HistoryLog.device_id, models.HistoryLog.timestamp.desc())
+        .all()
+    )
+    history = {device_id: [] for device_id in device_ids}
+    for row in rows:
+        history[row.device_id].append(row)
+    return history
+
+# Fields of a DeviceCreate report that are not columns of the devices table
+REPORT_ONLY_FIELDS = {"hardware_details", "base_snapshot_version"}
+
+class StaleSnapshotError(Exception):
+    """A delta report was based on a hardware snapshot version the server no longer has."""
+
+    def __init__(self, base_version: Optional[int], current_version: Optional[int]):
+        super().__init__(f"Delta based on snapshot {base_version}, server has {current_version}")
+        self.base_version = base_version
+        self.current_version = current_version
+
+def section_hash(value) -> str:
+    """Stable content hash of one hardware section, as stored in HardwareDetail.section_hashes."""
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+def _apply_device_update(db: Session, db_device: models.Device, update_data: dict) -> List[str]:
+    """Copies the given fields (and nested hardware details) onto an existing device.
+
+    Returns what changed: "device" for the device's own fields plus the names of
+    the changed hardware sections.
+    """
+    changed = []
     for key, value in update_data.items():
         if key == "hardware_details" and value is not None:
+            changed += [change["component"] for change in _sync_child_sections(db, db_device.id, value)]
+            value = {hw_key: hw_value for hw_key, hw_value in value.items() if hw_key not in CHILD_SECTIONS}
             if db_device.hardware_details:
                 for hw_key, hw_value in value.items():
+                    if getattr(db_device.hardware_details, hw_key) != hw_value:
+                        changed.append(hw_key)
                     setattr(db_device.hardware_details, hw_key, hw_value)
             else:
-                db_hardware = models.HardwareDetail(**value, device_id=db_device.id)
+                db_hardware = models.HardwareDetail(**value)
                 db.add(db_hardware)
                 db_device.hardware_details = db_hardware
+                changed += list(value)
+            for hw_key, hw_value in hardware_attributes.extract(value).items():
+                setattr(db_device.hardware_details, hw_key, hw_value)
+            hashes = dict(db_device.hardware_details.section_hashes or {})
+            hashes.update({hw_key: section_hash(hw_value) for hw_key, hw_value in value.items()})
+            db_device.hardware_details.section_hashes = hashes
         elif hasattr(db_device, key):
+            if getattr(db_device, key) != value:
+                changed.append("device")
             setattr(db_device, key, value)
+    return sorted(set(changed), key=lambda part: (part != "device", part))
+
+def version_key(version: Optional[str]) -> Tuple:
+    """Sort key comparing version strings numerically where possible ("1.10" > "1.9")."""
+    parts = re.findall(r"\d+|[A-Za-z]+", version or "")
+    return tuple((0, int(part), "") if part.isdigit() else (1, 0, part.lower()) for part in parts)
+
+def get_software_versions(db: Session, name: str) -> List[Tuple[Optional[str], int]]:
+    """Version distribution of a package across the fleet as ``(version, device_count)``."""
+    rows = db.execute(
+        select(models.InstalledSoftware.version, func.count(func.distinct(models.InstalledSoftware.device_id)))
+        .where(models.InstalledSoftware.name == name)
+        .group_by(models.InstalledSoftware.version)
+    ).all()
+    return sorted(((version, count) for version, count in rows), key=lambda row: version_key(row[0]))
+
+def matching_software_versions(db: Session, name: str, version_lt: Optional[str] = None,
+                               version_gte: Optional[str] = None) -> List[Optional[str]]:
+    """Installed versions of a package within [version_gte, version_lt), compared with version_key."""
+    versions = [version for version, _ in get_software_versions(db, name)]
+    if version_lt is not None:
+        versions = [v for v in versions if version_key(v) < version_key(version_lt)]
+    if version_gte is not None:
+        versions = [v for v in versions if version_key(v) >= version_key(version_gte)]
+    return versions
+
+def get_software_installs(db: Session, name: str, versions: Optional[List[Optional[str]]] = None,
+                          after: Optional[Tuple[int, int]] = None, limit: int = 100):
+    """Devices that have a package installed, keyset-paginated on (device_id, install row id).
+
+    Returns up to ``limit + 1`` rows of (InstalledSoftware, Device) in device order.
+    """
+    query = (
+        db.query(models.InstalledSoftware, models.Device)
+        .join(models.Device, models.Device.id == models.InstalledSoftware.device_id)
+        .filter(models.InstalledSoftware.name == name)
+    )
+    if versions is not None:
+        non_null = [v for v in versions if v is not None]
+        version_match = models.InstalledSoftware.version.in_(non_null)
+        if None in versions:
+            version_match = version_match | models.InstalledSoftware.version.is_(None)
+        query = query.filter(version_match)
+    if after is not None:
+        query = query.filter(tuple_(models.InstalledSoftware.device_id, models.InstalledSoftware.id) > tuple_(*after))
+    return query.order_by(models.InstalledSoftware.device_id, models.InstalledSoftware.id).limit(limit + 1).all()
+
+def get_devices_missing_software(db: Session, name: str, after_id: Optional[int] = None, limit: int = 100):
+    """Devices without a package, keyset-paginated on device id (up to ``limit + 1`` rows)."""
+    installed = (
+        select(models.InstalledSoftware.id)
+        .where(models.InstalledSoftware.device_id == models.Device.id, models.InstalledSoftware.name == name)
+        .exists()
+    )
+    query = (
+        db.query(models.Device)
+        .options(raiseload(models.Device.hardware_details), raiseload(models.Device.history_logs))
+        .filter(~installed)
+    )
+    if after_id is not None:
+        query = query.filter(models.Device.id > after_id)
+    devices = query.order_by(models.Device.id).limit(limit + 1).all()
+    _without_hardware(devices)
+    return devices
+
+def get_usb_attachments(db: Session, name: str, exact: bool = True, after: Optional[Tuple[int, int]] = None,
+                        limit: int = 100):
+    """Devices with a USB device attached, matched by exact name or name prefix.
+
+    Keyset-paginated on (device_id, row id); returns up to ``limit + 1`` rows of (UsbDevice, Device).
+    """
+    query = db.query(models.UsbDevice, models.Device).join(models.Device, models.Device.id == models.UsbDevice.device_id)
+    if exact:
+        query = query.filter(models.UsbDevice.name == name)
+    else:
+        query = query.filter(models.UsbDevice.name.like(escape_like(name) + "%", escape="\\"))
+    if after is not None:
+        query = query.filter(tuple_(models.UsbDevice.device_id, models.UsbDevice.id) > tuple_(*after))
+    return query.order_by(models.UsbDevice.device_id, models.UsbDevice.id).limit(limit + 1).all()
+
+def _insert(db: Session, model):
+    """Returns a dialect-specific INSERT supporting ON CONFLICT for the session's database."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model)
+    if dialect == "sqlite":
+        return sqlite.insert(model)
+    raise NotImplementedError(f"Upserts are not supported on {dialect}")
+
+def _software_key(item: dict) -> Optional[Tuple]:
+    name = item.get("name")
+    if not name:
+        return None
+    return (str(name), *(None if item.get(field) is None else str(item[field]) for field in ("version", "publisher", "install_date")))
+
+def _usb_key(item) -> Optional[Tuple]:
+    # Linux agents report raw lsusb lines, Windows agents report dicts
+    if isinstance(item, str):
+        return (item, None, None) if item else None
+    if not item.get("name"):
+        return None
+    return (str(item["name"]), item.get("device_id"), item.get("status"))
+
+# Hardware sections stored as rows of child tables: section -> (model, columns, key function)
+CHILD_SECTIONS = {
+    "installed_software": (models.InstalledSoftware, ("name", "version", "publisher", "install_date"), _software_key),
+    "usb_devices": (models.UsbDevice, ("name", "usb_device_id", "status"), _usb_key),
+}
+
+def sync_child_rows(db: Session, device_id: int, section: str, items: list) -> Tuple[List[Tuple], List[Tuple]]:
+    """Makes the device's rows for a child-table section match ``items`` with a set-based diff.
+
+    Only rows that disappeared are deleted and only new ones are inserted, each in
+    a single statement. Returns ``(added, removed)`` as lists of column tuples.
+    """
+    model, columns, key_of = CHILD_SECTIONS[section]
+    incoming = {key for key in map(key_of, items) if key is not None}
+    existing = {}
+    for row in db.execute(select(model.id, *(getattr(model, c) for c in columns)).where(model.device_id == device_id)):
+        existing.setdefault(tuple(row[1:]), []).append(row[0])
+
+    removed = [key for key in existing if key not in incoming]
+    added = [key for key in incoming if key not in existing]
+    stale_ids = [row_id for key in removed for row_id in existing[key]]
+    if stale_ids:
+        db.execute(delete(model).where(model.id.in_(stale_ids)))
+    if added:
+        db.execute(insert(model), [dict(zip(columns, key), device_id=device_id) for key in added])
+    return added, removed
+
+def _sync_child_sections(db: Session, device_id: int, sections: dict) -> List[dict]:
+    """Syncs the child-table sections present in ``sections``; returns their history entries."""
+    changes = []
+    for section, items in sections.items():
+        if section in CHILD_SECTIONS and items is not None:
+            added, removed = sync_child_rows(db, device_id, section, items)
+            changes += change_detection.diff_child_rows(section, CHILD_SECTIONS[section][1], added, removed)
+    return changes
+
+def _log_changes(db: Session, device_id: int, changes: List[dict], user: str):
+    """Writes a report's history entries with one multi-row INSERT."""
+    if changes:
+        db.execute(insert(models.HistoryLog), [dict(change, device_id=device_id, user=user) for change in changes])
+
+def _write_hardware(db: Session, device_id: int, hardware: schemas.HardwareDetailCreate,
+                    base_version: Optional[int] = None) -> List[str]:
+    """Writes only the hardware sections whose content hash differs from the stored one.
+
+    Most agent runs re-report identical hardware, so this usually reads one small
+    row (the stored hashes) and writes nothing. Every write bumps snapshot_version.
+    Changed sections are diffed against their stored values (list sections item by
+    item) and recorded as HistoryLog rows in one bulk insert.
+    With ``base_version`` the report is a delta carrying only changed sections, and
+    is applied only if the stored snapshot is still at that version; otherwise
+    StaleSnapshotError is raised and the agent must resend everything.
+    Returns the sections that were written.
+    """
+    incoming = hardware.model_dump(exclude_unset=True)
+    hashes = {section: section_hash(value) for section, value in incoming.items()}
+    # FOR UPDATE serializes concurrent reports for the same device on PostgreSQL
+    # (ignored on SQLite, where writers are serialized anyway)
+    stored = db.execute(
+        select(models.HardwareDetail.id, models.HardwareDetail.section_hashes, models.HardwareDetail.snapshot_version)
+        .where(models.HardwareDetail.device_id == device_id)
+        .with_for_update()
+    ).first()
+
+    if base_version is not None and (stored is None or stored.snapshot_version != base_version):
+        raise StaleSnapshotError(base_version, stored.snapshot_version if stored else None)
+
+    if stored is None:
+        promoted = hardware_attributes.extract(incoming)
+        stmt = _insert(db, models.HardwareDetail).values(
+            **hardware.model_dump(exclude=set(CHILD_SECTIONS)), **promoted, device_id=device_id,
+            section_hashes=hashes, snapshot_version=1,
+        )
+        # Another worker may have inserted the row since we looked
+        columns = [key for key in incoming if key not in CHILD_SECTIONS] + list(promoted)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["device_id"],
+            set_={
+                **{key: stmt.excluded[key] for key in [*columns, "section_hashes"]},
+                "snapshot_version": models.HardwareDetail.snapshot_version + 1,
+            },
+        )
+        db.execute(stmt)
+        # The first inventory of a device is its baseline, not a change
+        _sync_child_sections(db, device_id, incoming)
+        _bump_device_version(db, device_id)
+        return list(incoming)
+
+    stored_hashes = stored.section_hashes or {}
+    changed = {section: value for section, value in incoming.items() if stored_hashes.get(section) != hashes[section]}
+    if not changed:
+        return []
+    columns = {section: value for section, value in changed.items() if section not in CHILD_SECTIONS}
+
+    history = []
+    if columns:
+        previous = db.execute(
+            select(*(getattr(models.HardwareDetail, section) for section in columns))
+            .where(models.HardwareDetail.id == stored.id)
+        ).one()
+        for section, before in zip(columns, previous):
+            history += change_detection.diff_section(section, before, columns[section])
+
+    stmt = (
+        update(models.HardwareDetail)
+        .where(models.HardwareDetail.id == stored.id)
+        .values(**columns, **hardware_attributes.extract(columns), section_hashes={**stored_hashes, **hashes},
+                snapshot_version=models.HardwareDetail.snapshot_version + 1)
+    )
+    if base_version is not None:
+        stmt = stmt.where(models.HardwareDetail.snapshot_version == base_version)
+    if db.execute(stmt).rowcount == 0:
+        # A concurrent report moved the snapshot on between our read and write
+        raise StaleSnapshotError(base_version, None)
+    history += _sync_child_sections(db, device_id, changed)
+    _log_changes(db, device_id, history, user="agent")
+    _bump_device_version(db, device_id)
+    return list(changed)
+
+def _bump_device_version(db: Session, device_id: int):
+    db.execute(update(models.Device).where(models.Device.id == device_id).values(version=models.Device.version + 1))
+
+def _same_machine(row, reported: dict, key: str) -> bool:
+    """Whether a device matched on ``key`` can be the reporting machine: none of
+    its stronger identities contradicts the report's."""
+    for stronger in IDENTITY_KEYS[:IDENTITY_KEYS.index(key)]:
+        stored = getattr(row, stronger)
+        if stored and reported.get(stronger) and stored != reported[stronger]:
+            return False
+    return True
+
+def resolve_identity_keys(db: Session, device: schemas.DeviceCreate, use_map: bool = True) -> List[str]:
+    """Unique keys a report's upsert should conflict on, best first (see identity_map).
+
+    These are the identities the report shares with a stored device that can be
+    the same machine, strongest first, or for a new device its strongest identity.
+    A report whose strongest identity is in the identity map is resolved without
+    a query; otherwise one query looks up all of its identities at once.
+    """
+    reported = {key: getattr(device, key) for key in IDENTITY_KEYS if getattr(device, key)}
+    strongest = next(iter(reported))
+    if use_map and identity_map.get(strongest, reported[strongest]) is not None:
+        return [strongest]
+    columns = [getattr(models.Device, key) for key in IDENTITY_KEYS]
+    rows = db.execute(
+        select(models.Device.id, *columns).where(or_(*(getattr(models.Device, key) == value for key, value in reported.items())))
+    ).all()
+    keys = []
+    for key, value in reported.items():
+        for row in rows:
+            if getattr(row, key) == value and _same_machine(row, reported, key):
+                if not keys:
+                    identity_map.store(row.id, row._mapping)
+                keys.append(key)
+    return keys or [strongest]
+
+def _identity_attempts(db: Session, device: schemas.DeviceCreate) -> Iterator[Tuple[str, bool]]:
+    """``(key, release)`` pairs to try a report's upsert with, in order.
+
+    The identity map's answer is only checked against the database when the upsert
+    on it fails. When every key collides, the best one is tried once more with
+    ``release``: after taking the colliding identities away from other machines.
+    """
+    tried = []
+    for use_map in (True, False):
+        keys = resolve_identity_keys(db, device, use_map)
+        for key in keys:
+            if key not in tried:
+                tried.append(key)
+                yield key, False
+    yield keys[0], True
+
+def release_identities(db: Session, device: schemas.DeviceCreate) -> List[int]:
+    """Takes a report's identities away from stored devices whose stronger identities contradict it.
+
+    When two known machines swap DHCP leases, or a MAC-only device gets an IP that
+    another device still holds, the old holder keeps the value and the report's
+    upsert collides with it on every attempt. The old holders get NULL there
+    instead, and are re-versioned and re-rendered with this transaction.
+    Returns their ids. Does not commit.
+    """
+    reported = {key: getattr(device, key) for key in IDENTITY_KEYS if getattr(device, key)}
+    released = []
+    for key, value in reported.items():
+        stronger = [other for other in IDENTITY_KEYS[:IDENTITY_KEYS.index(key)] if other in reported]
+        if not stronger:
+            continue
+        contradicts = [
+            and_(getattr(models.Device, other).is_not(None), getattr(models.Device, other) != reported[other])
+            for other in stronger
+        ]
+        device_ids = db.execute(
+            update(models.Device)
+            .where(getattr(models.Device, key) == value, or_(*contradicts))
+            .values({key: None, "version": models.Device.version + 1})
+            .returning(models.Device.id)
+        ).scalars().all()
+        for device_id in device_ids:
+            _note_change(db, device_id, sections=["device"])
+        released.extend(device_ids)
+    identity_map.forget(released)
+    return released
+
+def remember_identities(reports: List[Tuple[int, schemas.DeviceCreate]]):
+    """Writes the identities of committed reports through to the identity map."""
+    for device_id, device in reports:
+        identity_map.store(device_id, {key: getattr(device, key) for key in IDENTITY_KEYS})
+
+def upsert_device(db: Session, device: schemas.DeviceCreate, key: Optional[str] = None,
+                  release: bool = False) -> Tuple[int, bool]:
+    """Creates or updates a device with INSERT ... ON CONFLICT on the given unique key.
+
+    Without ``key`` the best one from resolve_identity_keys is used. The write itself does not
+    depend on a prior read, so concurrent reports for the same device cannot race
+    each other into a duplicate insert. Raises IntegrityError when the report
+    collides with a different device on another unique key (e.g. a new IP that
+    another device still holds); callers retry with the next attempt of
+    _identity_attempts, the last of which runs release_identities first.
+    Raises StaleSnapshotError for a delta report against an outdated snapshot.
+    Returns ``(device_id, created)``. Does not commit; callers finish the
+    transaction with record_device_changes.
+    """
+    if key is None:
+        key = resolve_identity_keys(db, device)[0]
+    if release:
+        release_identities(db, device)
+    now = datetime.now()
+    stmt = _insert(db, models.Device).values(
+        **device.model_dump(exclude=REPORT_ONLY_FIELDS), created_at=now, last_seen=now, version=1
+    )
+    changes = device.model_dump(exclude_unset=True, exclude=REPORT_ONLY_FIELDS)
+    set_ = {field: stmt.excluded[field] for field in changes if field != key}
+    # A report that only refreshes last_seen is not a change of the device
+    changed = [getattr(models.Device, field).is_distinct_from(stmt.excluded[field]) for field in set_]
+    if changed:
+        set_["version"] = case((or_(*changed), models.Device.version + 1), else_=models.Device.version)
+    set_["last_seen"] = stmt.excluded.last_seen
+    stmt = stmt.on_conflict_do_update(index_elements=[key], set_=set_).returning(
+        models.Device.id,
+        # created_at only carries our timestamp if this statement inserted the row
+        (models.Device.created_at == now).label("created"),
+        models.Device.version,
+    )
+    device_id, created, fields_version = db.execute(stmt).one()
+
+    sections = []
+    if device.hardware_details is not None:
+        sections = _write_hardware(db, device_id, device.hardware_details, device.base_snapshot_version)
+    elif device.base_snapshot_version is not None:
+        raise StaleSnapshotError(device.base_snapshot_version, None)
+    _note_change(db, device_id, created=bool(created), sections=sections, fields_version=fields_version)
+    return device_id, bool(created)
+
+def _upsert_in_savepoint(db: Session, device: schemas.DeviceCreate) -> Tuple[int, bool]:
+    """Runs upsert_device inside a SAVEPOINT, falling back through the report's identity keys."""
+    attempts = _identity_attempts(db, device)
+    key, release = next(attempts)
+    while True:
+        try:
+            with db.begin_nested():
+                return upsert_device(db, device, key=key, release=release)
+        except IntegrityError:
+            key, release = next(attempts, (None, False))
+            if key is None:
+                raise
+
+def create_or_update_device(db: Session, device: schemas.DeviceCreate) -> bytes:
+    """Creates a new device or updates an existing one, identified by machine ID, MAC or IP address.
+
+    Returns its GET /devices/{id} body, taken from the write transaction itself
+    rather than read back after the commit.
+    """
+    attempts = _identity_attempts(db, device)
+    key, release = next(attempts)
+    while True:
+        try:
+            bodies = {}
+            device_id, _ = upsert_device(db, device, key=key, release=release)
+            events = record_device_changes(db, [device_id], bodies)
+            body = _device_body(db, device_id, bodies)
+            db.commit()
+            break
+        except StaleSnapshotError:
+            db.rollback()
+            discard_pending_changes(db)
+            raise
+        except IntegrityError:
+            # Another of the report's identities belongs to a different known device
+            # (e.g. an IP still held by a device that went offline), or the identity
+            # map was stale
+            db.rollback()
+            discard_pending_changes(db)
+            key, release = next(attempts, (None, False))
+            if key is None:
+                raise
+    remember_identities([(device_id, device)])
+    publish_changes([device_id], events)
+    return body
+
+def _upsert_chunk(db: Session, devices: List[schemas.DeviceCreate], savepoints: bool):
+    """Applies a chunk of reports inside the current transaction.
+
+    Each report is a single upsert statement. With ``savepoints`` every record runs
+    inside its own SAVEPOINT so a conflicting record only discards itself; delta
+    reports always do, so a stale one leaves nothing written.
+    """
+    results = []
+    for device in devices:
+        try:
+            if savepoints:
+                device_id, created = _upsert_in_savepoint(db, device)
+            elif device.base_snapshot_version is not None:
+                # A delta is found stale only after its device row is written, so it
+                # gets a SAVEPOINT to take that write back with it
+                with db.begin_nested():
+                    device_id, created = upsert_device(db, device)
+            else:
+                device_id, created = upsert_device(db, device)
+            results.append(("created" if created else "updated", device_id, None))
+        except StaleSnapshotError as e:
+            results.append(("stale", None, str(e)))
+        except IntegrityError as e:
+            if not savepoints:
+                raise
+            results.append(("error", None, str(e.orig)))
+    return results
+
+def bulk_upsert_devices(db: Session, devices: List[schemas.DeviceCreate]):
+    """Creates or updates a chunk of devices in a single transaction.
+
+    Returns one ``(status, device_id, detail)`` tuple per input record, in order,
+    where status is "created", "updated", "stale" (delta against an outdated
+    snapshot, resend in full) or "error".
+    """
+    try:
+        results = _upsert_chunk(db, devices, savepoints=False)
+    except IntegrityError:
+        # Some record in the chunk conflicts; replay it record by record so only
+        # the offending ones fail.
+        db.rollback()
+        discard_pending_changes(db)
+        results = _upsert_chunk(db, devices, savepoints=True)
+    device_ids = [device_id for _, device_id, _ in results if device_id is not None]
+    events = record_device_changes(db, device_ids)
+    db.commit()
+    remember_identities([(device_id, device) for (_, device_id, _), device in zip(results, devices) if device_id is not None])
+    publish_changes(device_ids, events)
+    return results
+
+def update_device_manual(db: Session, device_id: int, device_update: schemas.DeviceUpdate) -> Optional[bytes]:
+    """Applies a manual edit; returns the device's GET /devices/{id} body, or None if it does not exist."""
+    db_device = get_device_by_id(db, device_id=device_id)
+    if not db_device:
+        return None
+
+    changed = _apply_device_update(db, db_device, device_update.model_dump(exclude_unset=True))
+    if changed:
+        db_device.version = models.Device.version + 1
+        _note_change(db, device_id, sections=changed)
 
     try:
+        bodies = {}
+        events = record_device_changes(db, [device_id], bodies)
+        body = _device_body(db, device_id, bodies)
         db.commit()
-        db.refresh(db_device)
     except IntegrityError:
         db.rollback()
+        discard_pending_changes(db)
         raise
-    return db_device
+    if "device" in changed:
+        # Its IP or MAC may have changed; the next report resolves it again
+        identity_map.forget([device_id])
+    publish_changes([device_id], events)
+    return body
 
 def delete_device(db: Session, device_id: int):
     db_device = get_device_by_id(db, device_id=device_id)
     if db_device:
+        previous_stats = db.execute(
+            select(models.DeviceSnapshot.stats).where(models.DeviceSnapshot.device_id == device_id)
+        ).scalar()
+        _add_fleet_stats(db, fleet_stats.delta(previous_stats, None))
         db.delete(db_device)
+        event = {"device_id": device_id, "operation": "delete", "sections": None, "version": db_device.version}
+        _journal(db, [event])
         db.commit()
+        identity_map.forget([device_id])
+        publish_changes([device_id], [{**event, "device": None}])
         return True
     return False
@@ -0,0 +1,81 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterable, Iterator, List, Mapping
+
+import crud
+
+# Flattened CSV columns: the device itself plus the hardware fields most reports carry
+CSV_COLUMNS = [
+    "id", "name", "ip_address", "mac_address", "machine_id", "device_type", "os", "status", "last_seen", "created_at",
+    "cpu_brand", "cpu_model", "cpu_cores", "cpu_threads", "cpu_frequency_mhz",
+    "ram_total_gb", "disk_count", "disk_total_gb", "gpu_model", "gpu_vram_mb",
+    "motherboard_manufacturer", "motherboard_model", "motherboard_serial_number", "network_interfaces",
+]
+
+DEVICE_FIELDS = ["id", "name", "ip_address", "mac_address", "machine_id", "device_type", "os", "status", "last_seen", "created_at", "version"]
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _section(row: Mapping, name: str) -> dict:
+    value = row[name]
+    return value if isinstance(value, dict) else {}
+
+
+def flatten(row: Mapping) -> dict:
+    """One CSV record from an export row (device columns joined with hardware_details)."""
+    cpu, ram, gpu, board = (_section(row, name) for name in ("cpu_info", "ram_info", "gpu_info", "motherboard_info"))
+    disks = [disk for disk in row["disk_info"] or [] if isinstance(disk, dict)]
+    nics = [nic for nic in row["network_info"] or [] if isinstance(nic, dict)]
+    sizes = [disk["total_gb"] for disk in disks if isinstance(disk.get("total_gb"), (int, float))]
+    record = {field: row[field] for field in DEVICE_FIELDS if field in CSV_COLUMNS}
+    record.update(
+        cpu_brand=cpu.get("brand"),
+        cpu_model=cpu.get("model"),
+        cpu_cores=cpu.get("cores"),
+        cpu_threads=cpu.get("threads"),
+        cpu_frequency_mhz=cpu.get("frequency_mhz"),
+        ram_total_gb=ram.get("total_gb"),
+        disk_count=len(disks) if row["disk_info"] is not None else None,
+        disk_total_gb=round(sum(sizes), 2) if sizes else None,
+        gpu_model=gpu.get("model"),
+        gpu_vram_mb=gpu.get("vram_mb"),
+        motherboard_manufacturer=board.get("manufacturer"),
+        motherboard_model=board.get("model"),
+        motherboard_serial_number=board.get("serial_number"),
+        network_interfaces=";".join(str(nic.get("name")) for nic in nics) or None,
+    )
+    for key, value in record.items():
+        if isinstance(value, datetime):
+            record[key] = value.isoformat()
+    return record
+
+
+def ndjson_chunks(batches: Iterable[List[Mapping]]) -> Iterator[bytes]:
+    """One JSON document per device, with its hardware sections nested under hardware_details."""
+    for batch in batches:
+        lines = []
+        for row in batch:
+            record = {field: row[field] for field in DEVICE_FIELDS}
+            record["hardware_details"] = {field: row[field] for field in crud.EXPORT_HARDWARE_COLUMNS}
+            lines.append(json.dumps(record, default=_json_default, separators=(",", ":")))
+        yield ("\n".join(lines) + "\n").encode()
+
+
+def csv_chunks(batches: Iterable[List[Mapping]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+    writer.writeheader()
+    # The header goes out before the first query batch is fetched
+    yield buffer.getvalue().encode()
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(flatten(row) for row in batch)
+        yield buffer.getvalue().encode()
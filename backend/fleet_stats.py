@@ -0,0 +1,79 @@
+"""Fleet-wide counters behind GET /stats.
+
+Each device contributes a small set of ``(metric, key) -> amount`` entries
+(one device with OS "Windows 11" adds 1 to ("os", "Windows 11")). The stored
+device snapshot keeps the contribution it was rendered with, so every write only
+adds the difference between the old and new contribution to the fleet_stats
+table. Run ``python fleet_stats.py`` to rebuild the counters from scratch.
+"""
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+# Share of free space under which a disk counts as nearly full
+LOW_DISK_FREE_RATIO = 0.10
+
+COUNT_DIMENSIONS = ("os", "device_type", "status")
+
+
+def _low_on_disk(disks) -> bool:
+    for disk in disks or []:
+        if not isinstance(disk, dict):
+            continue
+        for volume in [disk, *(part for part in disk.get("partitions") or [] if isinstance(part, dict))]:
+            total, free = volume.get("total_gb"), volume.get("free_gb")
+            if isinstance(total, (int, float)) and isinstance(free, (int, float)) and total > 0:
+                if free / total < LOW_DISK_FREE_RATIO:
+                    return True
+    return False
+
+
+def contribution(device, hardware) -> Dict[str, float]:
+    """What one device adds to the fleet counters, keyed "metric:key" (JSON-friendly)."""
+    amounts = {"devices:total": 1}
+    for dimension in COUNT_DIMENSIONS:
+        amounts[f"{dimension}:{getattr(device, dimension) or ''}"] = 1
+    if hardware is not None:
+        ram = hardware.ram_info or {}
+        if isinstance(ram.get("total_gb"), (int, float)):
+            amounts["ram_total_gb:sum"] = ram["total_gb"]
+        if _low_on_disk(hardware.disk_info):
+            amounts["low_disk_devices:total"] = 1
+    return amounts
+
+
+def delta(before: Optional[Dict[str, float]], after: Optional[Dict[str, float]]) -> Dict[Tuple[str, str], float]:
+    """Per-``(metric, key)`` amounts to add to go from ``before`` to ``after``."""
+    change = Counter()
+    for entry, amount in (after or {}).items():
+        change[entry] += amount
+    for entry, amount in (before or {}).items():
+        change[entry] -= amount
+    return {tuple(entry.split(":", 1)): amount for entry, amount in change.items() if amount}
+
+
+def summarize(rows) -> dict:
+    """GET /stats body from the fleet_stats ``(metric, key, value)`` rows."""
+    summary = {"devices": 0, "ram_total_gb": 0.0, "low_disk_devices": 0}
+    summary.update({f"by_{dimension}": {} for dimension in COUNT_DIMENSIONS})
+    for metric, key, value in rows:
+        if metric in COUNT_DIMENSIONS:
+            if value:
+                summary[f"by_{metric}"][key or "unknown"] = int(value)
+        elif metric == "ram_total_gb":
+            summary["ram_total_gb"] = round(value, 2)
+        elif metric in ("devices", "low_disk_devices"):
+            summary[metric] = int(value)
+    return summary
+
+
+if __name__ == "__main__":
+    import logging
+
+    import crud, database
+
+    logging.basicConfig(level=logging.INFO)
+    session = database.SessionLocal()
+    try:
+        logging.getLogger(__name__).info("Rebuilt fleet stats from %s devices", crud.rebuild_fleet_stats(session))
+    finally:
+        session.close()
@@ -0,0 +1,172 @@
+"""Hardware attributes that can be filtered on without parsing JSON per row.
+
+The hardware sections of HardwareDetail are opaque JSON. Two ways make them
+queryable with an index:
+
+* Promoted attributes (PROMOTED): typed columns of hardware_details, with a
+  B-tree index each, extracted from their section whenever it is written. They
+  serve range filters such as ``ram_total_gb<8``. Adding an entry here adds the
+  column (migrate.py creates and backfills it) and makes it filterable.
+* JSON paths (``section.key`` of an object section, e.g. ``cpu_info.brand``):
+  equality uses a GIN index of the section's JSONB on PostgreSQL and, for the
+  paths in JSON_PATH_INDEXES, a json_extract() expression index on SQLite.
+  Other paths and range comparisons on paths still work, as scans.
+
+Filters are written ``<attribute or path><op><value>``, op one of
+``= != < <= > >=`` (only ``=`` and ranges on paths).
+"""
+import json
+import re
+from typing import Callable, NamedTuple, Optional, Tuple
+
+from sqlalchemy import Float, Index, Integer, String, case, cast, func, literal_column
+from sqlalchemy.dialects.postgresql import JSONB
+
+
+class PromotedAttribute(NamedTuple):
+    section: str
+    type_: type
+    extract: Callable[[object], object]
+
+
+def _number(convert):
+    def coerce(value):
+        if isinstance(value, bool):
+            return None
+        try:
+            return convert(value) if value is not None else None
+        except (TypeError, ValueError):
+            return None
+    return coerce
+
+
+def _text(value) -> Optional[str]:
+    if value is None:
+        return None
+    return str(value).strip() or None
+
+
+def _field(key: str, coerce):
+    def extract(section):
+        return coerce(section.get(key)) if isinstance(section, dict) else None
+    return extract
+
+
+def _disk_sum(key: str):
+    def extract(disks):
+        if not isinstance(disks, list):
+            return None
+        sizes = [_number(float)(disk.get(key)) for disk in disks if isinstance(disk, dict)]
+        sizes = [size for size in sizes if size is not None]
+        return round(sum(sizes), 2) if sizes else None
+    return extract
+
+
+PROMOTED = {
+    "cpu_model": PromotedAttribute("cpu_info", String, _field("model", _text)),
+    "cpu_cores": PromotedAttribute("cpu_info", Integer, _field("cores", _number(int))),
+    "cpu_threads": PromotedAttribute("cpu_info", Integer, _field("threads", _number(int))),
+    "ram_total_gb": PromotedAttribute("ram_info", Float, _field("total_gb", _number(float))),
+    "disk_total_gb": PromotedAttribute("disk_info", Float, _disk_sum("total_gb")),
+    "disk_free_gb": PromotedAttribute("disk_info", Float, _disk_sum("free_gb")),
+}
+
+# Hardware sections that hold one JSON object (the others are lists)
+OBJECT_SECTIONS = ("cpu_info", "ram_info", "gpu_info", "motherboard_info", "temperature_info", "power_supply_info")
+
+# JSON paths given an index; on PostgreSQL their sections get a GIN index, which
+# serves equality on any path of that section
+JSON_PATH_INDEXES = ("cpu_info.brand", "gpu_info.model", "motherboard_info.manufacturer", "motherboard_info.model")
+
+OPERATORS = {
+    "=": lambda column, value: column == value,
+    "!=": lambda column, value: column != value,
+    "<": lambda column, value: column < value,
+    "<=": lambda column, value: column <= value,
+    ">": lambda column, value: column > value,
+    ">=": lambda column, value: column >= value,
+}
+
+_FILTER = re.compile(r"^\s*([a-z_]+(?:\.[A-Za-z0-9_]+)?)\s*(<=|>=|!=|=|<|>)\s*(.*?)\s*$")
+_KEY = re.compile(r"^[A-Za-z0-9_]+$")
+
+
+def extract(sections: dict) -> dict:
+    """Promoted column values for the attributes whose section is in ``sections``."""
+    return {name: attribute.extract(sections[attribute.section])
+            for name, attribute in PROMOTED.items() if attribute.section in sections}
+
+
+def parse_filter(expression: str) -> Tuple[str, str, object]:
+    """``(attribute or path, op, value)`` of a filter expression; raises ValueError if invalid."""
+    match = _FILTER.match(expression)
+    if not match:
+        raise ValueError(f"Invalid hardware filter {expression!r}, expected e.g. ram_total_gb<8 or cpu_info.brand=AMD")
+    path, op, raw = match.groups()
+    if path in PROMOTED:
+        type_ = PROMOTED[path].type_
+        try:
+            value = int(raw) if type_ is Integer else float(raw) if type_ is Float else raw
+        except ValueError:
+            raise ValueError(f"{path} takes a number, got {raw!r}")
+        return path, op, value
+
+    section, _, key = path.partition(".")
+    if section not in OBJECT_SECTIONS or not key:
+        known = ", ".join([*PROMOTED, *(f"{section}.<key>" for section in OBJECT_SECTIONS)])
+        raise ValueError(f"Unknown hardware attribute {path!r}; use one of {known}")
+    if op == "!=":
+        raise ValueError("JSON paths support =, <, <=, > and >=")
+    # Numbers match JSON numbers; quote a value to match it as a string
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        value = raw
+    if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+        value = raw
+    if op != "=" and not isinstance(value, (int, float)):
+        raise ValueError(f"Range comparisons on {path} take a number, got {raw!r}")
+    return path, op, value
+
+
+def json_path(column, key: str):
+    """json_extract(column, '$.key'), with the path inlined so SQLite can match it to an expression index."""
+    if not _KEY.match(key):
+        raise ValueError(f"Invalid JSON key {key!r}")
+    return func.json_extract(column, literal_column(f"'$.{key}'"))
+
+
+def condition(hardware, dialect: str, parsed: Tuple[str, str, object]):
+    """SQL condition on HardwareDetail for a parsed filter."""
+    path, op, value = parsed
+    if path in PROMOTED:
+        return OPERATORS[op](getattr(hardware, path), value)
+    section, _, key = path.partition(".")
+    column = getattr(hardware, section)
+    if dialect == "postgresql":
+        document = cast(column, JSONB)
+        if op == "=":
+            # Containment is what the section's jsonb_path_ops GIN index serves
+            return document.contains({key: value})
+        # CASE, not AND: PostgreSQL does not promise to check the type before the cast,
+        # which fails on a non-numeric value; other types compare as NULL (no match)
+        number = case((func.jsonb_typeof(document[key]) == "number", cast(document[key].astext, Float)))
+        return OPERATORS[op](number, value)
+    return OPERATORS[op](json_path(column, key), value)
+
+
+def json_indexes(table) -> list:
+    """Indexes backing the JSON path filters on ``table`` (hardware_details), per dialect."""
+    indexes = []
+    for section in dict.fromkeys(path.partition(".")[0] for path in JSON_PATH_INDEXES):
+        document = cast(table.c[section], JSONB).label(f"{section}_jsonb")
+        indexes.append(
+            Index(f"ix_hardware_details_{section}_gin", document,
+                  postgresql_using="gin", postgresql_ops={document.name: "jsonb_path_ops"}).ddl_if(dialect="postgresql")
+        )
+    for path in JSON_PATH_INDEXES:
+        section, _, key = path.partition(".")
+        indexes.append(
+            Index(f"ix_hardware_details_{section}_{key}", json_path(table.c[section], key)).ddl_if(dialect="sqlite")
+        )
+    return indexes
@@ -0,0 +1,272 @@
+"""History retention for history_logs.
+
+Two age-based policies keep the hot table small:
+
+* rollup: raw per-section changes older than HISTORY_ROLLUP_AFTER_DAYS are
+  compacted into one row per device, component and day (or week), keeping the
+  earliest "before" and the latest "after" value;
+* archive: rows older than HISTORY_HOT_DAYS are appended to compressed,
+  append-only monthly NDJSON segments in HISTORY_ARCHIVE_DIR and deleted from
+  the database. GET /history and GET /devices/{id}/history read them back on
+  demand with include_archive=true.
+
+Run periodically (e.g. from cron) with ``python history_retention.py``.
+"""
+import argparse
+import gzip
+import io
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+
+import database, models
+
+try:
+    import zstandard
+except ImportError:  # archive segments fall back to gzip
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+HOT_DAYS = int(os.getenv("HISTORY_HOT_DAYS", "180"))
+ROLLUP_AFTER_DAYS = int(os.getenv("HISTORY_ROLLUP_AFTER_DAYS", "30"))
+ROLLUP_PERIOD = os.getenv("HISTORY_ROLLUP_PERIOD", "day")  # "day" or "week"
+ARCHIVE_DIR = os.getenv("HISTORY_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "history_archive"))
+BATCH_SIZE = 5000
+
+ROLLUP_USER = "rollup"
+
+
+def _cutoff(days: int) -> datetime:
+    return datetime.now(timezone.utc) - timedelta(days=days)
+
+
+def naive_utc(ts: datetime) -> datetime:
+    """Timestamps come back naive from SQLite and aware from PostgreSQL; compare them as naive UTC."""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def _period_start(ts: datetime, period: str) -> datetime:
+    day = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "week":
+        day -= timedelta(days=day.weekday())
+    return day
+
+
+# --- Rollup ---
+
+def rollup_history(db: Session, older_than_days: int = ROLLUP_AFTER_DAYS, period: str = ROLLUP_PERIOD) -> Tuple[int, int]:
+    """Compacts raw history older than the cutoff into per-period rollup rows.
+
+    Returns ``(raw rows removed, rollup rows written)``. Rows are handled one
+    device at a time, each in its own transaction.
+    """
+    cutoff = _cutoff(older_than_days)
+    raw = models.HistoryLog.rollup_count.is_(None)
+    device_ids = db.execute(
+        select(models.HistoryLog.device_id).where(raw, models.HistoryLog.timestamp < cutoff).distinct()
+    ).scalars().all()
+
+    removed = written = 0
+    for device_id in device_ids:
+        rows = db.execute(
+            select(models.HistoryLog)
+            .where(models.HistoryLog.device_id == device_id, raw, models.HistoryLog.timestamp < cutoff)
+            .order_by(models.HistoryLog.component, models.HistoryLog.timestamp, models.HistoryLog.id)
+        ).scalars().all()
+        rollups, obsolete, singles = [], [], []
+        for (component, start), group in groupby(rows, key=lambda r: (r.component, _period_start(naive_utc(r.timestamp), period))):
+            group = list(group)
+            if len(group) == 1:
+                singles.append(group[0].id)
+                continue
+            rollups.append({
+                "device_id": device_id,
+                "timestamp": start.replace(tzinfo=timezone.utc),
+                "component": component,
+                "change_description": f"{len(group)} changes between {naive_utc(group[0].timestamp):%Y-%m-%d %H:%M} "
+                                      f"and {naive_utc(group[-1].timestamp):%Y-%m-%d %H:%M}",
+                "details_before": group[0].details_before,
+                "details_after": group[-1].details_after,
+                "user": ROLLUP_USER,
+                "rollup_count": len(group),
+            })
+            obsolete += [r.id for r in group]
+        if rollups:
+            db.execute(insert(models.HistoryLog), rollups)
+        for chunk_start in range(0, len(obsolete), BATCH_SIZE):
+            db.execute(delete(models.HistoryLog).where(models.HistoryLog.id.in_(obsolete[chunk_start:chunk_start + BATCH_SIZE])))
+        # A lone change stays as it is, but is marked so later runs skip it
+        for chunk_start in range(0, len(singles), BATCH_SIZE):
+            db.execute(
+                update(models.HistoryLog)
+                .where(models.HistoryLog.id.in_(singles[chunk_start:chunk_start + BATCH_SIZE]))
+                .values(rollup_count=1)
+            )
+        db.commit()
+        removed += len(obsolete)
+        written += len(rollups)
+    return removed, written
+
+
+# --- Archive segments ---
+
+def _segment_suffix() -> str:
+    return ".ndjson.zst" if zstandard else ".ndjson.gz"
+
+
+def segment_path(month: str, archive_dir: str = ARCHIVE_DIR) -> str:
+    return os.path.join(archive_dir, f"history-{month}{_segment_suffix()}")
+
+
+def _compress(data: bytes) -> bytes:
+    if zstandard:
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data)
+
+
+def _decompress(data: bytes) -> bytes:
+    # Each archive run appends one independent frame/member to the segment
+    if zstandard:
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True)
+        return reader.read()
+    return gzip.decompress(data)
+
+
+def _to_record(row: models.HistoryLog) -> dict:
+    return {
+        "id": row.id,
+        "device_id": row.device_id,
+        "timestamp": naive_utc(row.timestamp).isoformat(),
+        "component": row.component,
+        "change_description": row.change_description,
+        "details_before": row.details_before,
+        "details_after": row.details_after,
+        "user": row.user,
+        "rollup_count": row.rollup_count,
+    }
+
+
+def _append_segment(month: str, records: List[dict], archive_dir: str):
+    os.makedirs(archive_dir, exist_ok=True)
+    payload = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records).encode()
+    with open(segment_path(month, archive_dir), "ab") as segment:
+        segment.write(_compress(payload))
+        segment.flush()
+        os.fsync(segment.fileno())
+
+
+def archive_history(db: Session, older_than_days: int = HOT_DAYS, archive_dir: str = ARCHIVE_DIR) -> int:
+    """Moves history rows older than the cutoff into monthly archive segments.
+
+    Rows are appended (and fsynced) to their segment before being deleted, so a
+    crash can at worst archive a batch twice; readers drop duplicate ids.
+    Returns the number of rows archived.
+    """
+    cutoff = _cutoff(older_than_days)
+    archived = 0
+    while True:
+        rows = db.execute(
+            select(models.HistoryLog)
+            .where(models.HistoryLog.timestamp < cutoff)
+            .order_by(models.HistoryLog.timestamp, models.HistoryLog.id)
+            .limit(BATCH_SIZE)
+        ).scalars().all()
+        if not rows:
+            return archived
+        records = [_to_record(row) for row in rows]
+        for month, month_records in groupby(records, key=lambda r: r["timestamp"][:7]):
+            _append_segment(month, list(month_records), archive_dir)
+        db.execute(delete(models.HistoryLog).where(models.HistoryLog.id.in_([row.id for row in rows])))
+        db.commit()
+        archived += len(rows)
+
+
+def _months_between(start: datetime, end: datetime) -> Iterator[str]:
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        yield f"{year:04d}-{month:02d}"
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def read_archive(filters: dict, after: Optional[Tuple[datetime, int]] = None, limit: int = 100,
+                 ascending: bool = False, archive_dir: str = ARCHIVE_DIR) -> List[models.HistoryLog]:
+    """Reads archived history matching the same filters as crud.get_history_page.
+
+    Only the monthly segments overlapping [since, until) are decompressed.
+    Returns up to ``limit + 1`` transient HistoryLog objects in (timestamp, id) order.
+    """
+    if not os.path.isdir(archive_dir):
+        return []
+    months = sorted(
+        name[len("history-"):len("history-") + 7]
+        for name in os.listdir(archive_dir)
+        if name.startswith("history-") and name.endswith(_segment_suffix())
+    )
+    if filters.get("since") is not None or filters.get("until") is not None:
+        first = naive_utc(filters["since"]) if filters.get("since") else datetime.min
+        last = naive_utc(filters["until"]) if filters.get("until") else datetime.max
+        wanted = set(_months_between(max(first, datetime(1970, 1, 1)), min(last, datetime(9999, 1, 1))))
+        months = [month for month in months if month in wanted]
+
+    matches = {}
+    for month in months:
+        with open(segment_path(month, archive_dir), "rb") as segment:
+            lines = _decompress(segment.read()).splitlines()
+        for record in _matching(map(json.loads, lines), filters, after, ascending):
+            matches[record["id"]] = record
+
+    ordered = sorted(matches.values(), key=lambda r: (r["timestamp"], r["id"]), reverse=not ascending)
+    return [_from_record(record) for record in ordered[:limit + 1]]
+
+
+def _matching(records: Iterable[dict], filters: dict, after, ascending: bool) -> Iterator[dict]:
+    since = naive_utc(filters["since"]).isoformat() if filters.get("since") else None
+    until = naive_utc(filters["until"]).isoformat() if filters.get("until") else None
+    bound = (naive_utc(after[0]).isoformat(), after[1]) if after else None
+    for record in records:
+        if any(filters.get(field) is not None and record[field] != filters[field] for field in ("device_id", "component", "user")):
+            continue
+        if since and record["timestamp"] < since or until and record["timestamp"] >= until:
+            continue
+        if bound:
+            position = (record["timestamp"], record["id"])
+            if (position <= bound) if ascending else (position >= bound):
+                continue
+        yield record
+
+
+def _from_record(record: dict) -> models.HistoryLog:
+    return models.HistoryLog(**dict(record, timestamp=datetime.fromisoformat(record["timestamp"])))
+
+
+def run_retention(db: Session) -> dict:
+    removed, written = rollup_history(db)
+    archived = archive_history(db)
+    return {"rolled_up": removed, "rollups_written": written, "archived": archived}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply history retention policies (rollup and archive)")
+    parser.add_argument("--skip-rollup", action="store_true", help="Only archive expired rows")
+    parser.add_argument("--skip-archive", action="store_true", help="Only compact old rows into rollups")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    session = database.SessionLocal()
+    try:
+        if not args.skip_rollup:
+            removed, written = rollup_history(session)
+            logger.info("Rolled up %s history rows into %s rollups", removed, written)
+        if not args.skip_archive:
+            logger.info("Archived %s history rows to %s", archive_history(session), ARCHIVE_DIR)
+    finally:
+        session.close()
@@ -0,0 +1,85 @@
+"""In-process identity map: which device a report belongs to.
+
+Agents identify themselves by ``machine_id`` (stable across DHCP leases and NIC
+swaps), then ``mac_address``, then ``ip_address``; each is a unique column of
+devices. The map caches ``(key, value) -> device id`` for every identity of the
+devices this worker has written, so resolving a known agent's report is one
+dictionary lookup instead of a query.
+
+Entries are written through after each committed device write and dropped when
+a device is deleted or its identity changes. The map only decides which unique
+key the upsert conflicts on; the INSERT ... ON CONFLICT itself stays the source
+of truth, so an entry made stale by another worker costs a retry, never a
+wrong row.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+# Identity keys of a device, strongest first
+IDENTITY_KEYS = ("machine_id", "mac_address", "ip_address")
+
+
+class IdentityMap:
+    """Bounded LRU of ``(key, value) -> device id`` plus the reverse index used to invalidate a device."""
+
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        self._by_device = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: str, value: Optional[str]) -> Optional[int]:
+        if not value or self.maxsize <= 0:
+            return None
+        with self._lock:
+            device_id = self._entries.get((key, value))
+            if device_id is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end((key, value))
+            self._stats["hits"] += 1
+            return device_id
+
+    def store(self, device_id: int, identities: dict):
+        """Records the current identities of a device, replacing whatever it had before."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._forget(device_id)
+            keys = [(key, identities[key]) for key in IDENTITY_KEYS if identities.get(key)]
+            for entry in keys:
+                previous = self._entries.pop(entry, None)
+                if previous is not None and previous != device_id:
+                    # The value moved to this device (e.g. an IP handed to another machine)
+                    self._by_device.get(previous, set()).discard(entry)
+                self._entries[entry] = device_id
+            self._by_device[device_id] = set(keys)
+            while len(self._entries) > self.maxsize:
+                entry, owner = self._entries.popitem(last=False)
+                self._by_device.get(owner, set()).discard(entry)
+                self._stats["evictions"] += 1
+
+    def forget(self, device_ids: Iterable[int]):
+        with self._lock:
+            for device_id in device_ids:
+                self._forget(device_id)
+
+    def _forget(self, device_id: int):
+        for entry in self._by_device.pop(device_id, ()):
+            if self._entries.get(entry) == device_id:
+                del self._entries[entry]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_device.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, size=len(self._entries), maxsize=self.maxsize)
+
+
+identity_map = IdentityMap(maxsize=int(os.getenv("IDENTITY_MAP_SIZE", "100000")))
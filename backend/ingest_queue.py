@@ -0,0 +1,179 @@
+import logging
+import os
+import queue
+import threading
+import time
+from typing import List, Optional
+
+import crud, database, schemas
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueue:
+    """Bounded in-process write-behind queue for agent reports.
+
+    POST /devices/ puts validated reports here and answers 202 immediately; a single
+    background thread drains the queue into the database in batches of up to
+    ``batch_size`` reports, or whatever arrived within ``flush_interval`` seconds,
+    using one transaction per batch (crud.bulk_upsert_devices).
+
+    A batch whose transaction fails (database unreachable, locked, ...) is retried
+    ``retries`` times with exponential backoff from ``retry_delay`` seconds, then
+    written one report per transaction; only reports that still fail are dropped.
+    """
+
+    def __init__(self, maxsize: int = 10000, batch_size: int = 500, flush_interval: float = 0.5,
+                 retries: int = 3, retry_delay: float = 0.5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "rejected": 0,
+            "written": 0,
+            "failed": 0,
+            "dropped": 0,
+            "retries": 0,
+            "batches": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+        logger.info("Ingest writer started (maxsize=%s, batch_size=%s)", self._queue.maxsize, self.batch_size)
+
+    def stop(self, timeout: Optional[float] = 30.0):
+        """Stops the writer after draining everything already queued."""
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning("Ingest writer did not drain within %ss; %s reports left", timeout, self._queue.qsize())
+        self._thread = None
+
+    def submit(self, device: schemas.DeviceCreate) -> bool:
+        """Queues a report without blocking. Returns False if the queue is full."""
+        try:
+            self._queue.put_nowait(device)
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected"] += 1
+            return False
+        with self._lock:
+            self._stats["enqueued"] += 1
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        batches = stats.pop("batches")
+        total_ms = stats.pop("total_flush_ms")
+        stats.update(
+            running=self.running,
+            depth=self._queue.qsize(),
+            capacity=self._queue.maxsize,
+            batches=batches,
+            avg_flush_ms=round(total_ms / batches, 3) if batches else 0.0,
+        )
+        return stats
+
+    def _next_batch(self) -> List[schemas.DeviceCreate]:
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def _write(self, batch: List[schemas.DeviceCreate]) -> int:
+        """Writes ``batch`` in one transaction; returns how many reports the database refused."""
+        db = database.SessionLocal()
+        try:
+            outcomes = crud.bulk_upsert_devices(db, batch)
+        finally:
+            db.close()
+        return sum(1 for outcome, _, _ in outcomes if outcome in ("error", "stale"))
+
+    def _write_with_retries(self, batch: List[schemas.DeviceCreate]) -> int:
+        delay = self.retry_delay
+        for _ in range(self.retries):
+            try:
+                return self._write(batch)
+            except Exception:
+                logger.warning("Failed to write a batch of %s queued reports, retrying in %.1f s",
+                               len(batch), delay, exc_info=True)
+                with self._lock:
+                    self._stats["retries"] += 1
+                time.sleep(delay)
+                delay *= 2
+        return self._write(batch)
+
+    def _flush(self, batch: List[schemas.DeviceCreate]):
+        started = time.perf_counter()
+        failed = dropped = 0
+        try:
+            failed = self._write_with_retries(batch)
+        except Exception:
+            logger.exception("Failed to write a batch of %s queued reports; writing them one at a time", len(batch))
+            # Keeps whatever part of the batch the database still accepts
+            for device in batch:
+                try:
+                    failed += self._write([device])
+                except Exception:
+                    logger.exception("Dropped the queued report of %s",
+                                     device.machine_id or device.mac_address or device.ip_address)
+                    dropped += 1
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["written"] += len(batch) - failed - dropped
+            self._stats["failed"] += failed
+            self._stats["dropped"] += dropped
+            self._stats["last_flush_ms"] = round(elapsed_ms, 3)
+            self._stats["max_flush_ms"] = round(max(self._stats["max_flush_ms"], elapsed_ms), 3)
+            self._stats["total_flush_ms"] += elapsed_ms
+
+# "sync" (default) commits every report before answering; "async" answers 202 and
+# writes reports through the queue below.
+INGEST_MODE = os.getenv("INGEST_MODE", "sync").lower()
+
+ingest_queue = IngestQueue(
+    maxsize=int(os.getenv("INGEST_QUEUE_SIZE", "10000")),
+    batch_size=int(os.getenv("INGEST_BATCH_SIZE", "500")),
+    flush_interval=float(os.getenv("INGEST_FLUSH_INTERVAL", "0.5")),
+    retries=int(os.getenv("INGEST_RETRIES", "3")),
+    retry_delay=float(os.getenv("INGEST_RETRY_DELAY", "0.5")),
+)
+
+
+def async_ingest_enabled() -> bool:
+    return INGEST_MODE == "async"
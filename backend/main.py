@@ -1,34 +1,135 @@
-from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy.orm import Session
-import models, database, schemas # schemas will be created next
-
-# Create database tables on startup (for development only, use Alembic for production)
-models.Base.metadata.create_all(bind=database.engine)
-
-app = FastAPI(
-    title="Inventory & Monitoring API",
-    description="API for managing network device inventory and hardware details.",
-    version="0.1.0"
-)
-
-# Dependency to get DB session
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-@app.get("/", tags=["Root"])
-def read_root():
-    """Provides a simple welcome message."""
-    return {"message": "Welcome to the Inventory & Monitoring API"}
-
-# Placeholder for future routers/endpoints
-from routers import devices # Example: Routers will be added later
-app.include_router(devices.router)
-# app.include_router(history.router)
-
-# Note: Pydantic schemas (schemas.py) need to be created for request/response validation.
-# Note: Routers for specific functionalities (devices, history, etc.) will be added in the next steps.
+import time
 
+# Startup time is measured from here to the end of warmup
+_IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+import database, migrate, warmup
+from ingest_queue import ingest_queue, async_ingest_enabled
+from routers import changes, devices, diagnostics, history, search, software, stats, usb
+
+logger = logging.getLogger(__name__)
+
+# Schema changes are applied by `python migrate.py` before workers start; set
+# AUTO_MIGRATE=true to have each worker apply them at startup instead (development)
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "false").lower() in ("1", "true", "yes")
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "5"))
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "3000"))
+
+# Backoff between failed startup preparations (e.g. the database is not up yet)
+STARTUP_RETRY_DELAY = float(os.getenv("STARTUP_RETRY_DELAY", "1"))
+STARTUP_RETRY_MAX_DELAY = float(os.getenv("STARTUP_RETRY_MAX_DELAY", "30"))
+
+async def prepare(app: FastAPI):
+    """Migrates (if enabled) and warms up off the event loop, then marks the worker ready.
+
+    A failed attempt is retried with exponential backoff until one succeeds, so a
+    database that is briefly unreachable at boot only delays readiness.
+    """
+    state = app.state
+    delay = STARTUP_RETRY_DELAY
+    while True:
+        state.startup_attempts += 1
+        try:
+            if AUTO_MIGRATE:
+                await run_in_threadpool(migrate.migrate)
+            state.warmup = await run_in_threadpool(warmup.warm_up, WARMUP_CONNECTIONS)
+            if database.ASYNC_DB:
+                state.warmup["async_connections"] = await warmup.open_async_connections(WARMUP_CONNECTIONS)
+            break
+        except Exception as e:
+            logger.exception("Startup preparation failed (attempt %s), retrying in %.0f s", state.startup_attempts, delay)
+            state.startup_error = str(e).splitlines()[0]
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, STARTUP_RETRY_MAX_DELAY)
+    state.startup_error = None
+    state.startup_ms = round((time.perf_counter() - _IMPORT_STARTED) * 1000, 1)
+    state.ready = True
+    if state.startup_ms > STARTUP_BUDGET_MS:
+        logger.warning("Startup took %.0f ms, over the %.0f ms budget", state.startup_ms, STARTUP_BUDGET_MS)
+    else:
+        logger.info("Ready in %.0f ms", state.startup_ms)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    app.state.startup_ms = None
+    app.state.startup_error = None
+    app.state.startup_attempts = 0
+    app.state.warmup = None
+    if async_ingest_enabled():
+        ingest_queue.start()
+    # Warmup runs in the background: the worker answers /healthz right away and
+    # /readyz once it is warm
+    preparing = asyncio.create_task(prepare(app))
+    yield
+    preparing.cancel()
+    # Drain queued reports before the worker exits
+    await run_in_threadpool(ingest_queue.stop)
+    await database.dispose_async_engines()
+
+def check_database():
+    with database.get_read_engine().connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+def create_app() -> FastAPI:
+    """Builds the API. Importing this module touches neither the database nor the schema."""
+    app = FastAPI(
+        title="Inventory & Monitoring API",
+        description="API for managing network device inventory and hardware details.",
+        version="0.1.0",
+        lifespan=lifespan,
+    )
+
+    @app.get("/", tags=["Root"])
+    def read_root():
+        """Provides a simple welcome message."""
+        return {"message": "Welcome to the Inventory & Monitoring API"}
+
+    @app.get("/healthz", tags=["Root"])
+    def read_health():
+        """Liveness: the process is up and serving requests."""
+        return {"status": "ok"}
+
+    @app.get("/readyz", tags=["Root"])
+    def read_readiness():
+        """Readiness: warmup finished and the database answers; 503 otherwise."""
+        state = app.state
+        body = {
+            "ready": state.ready,
+            "startup_ms": state.startup_ms,
+            "startup_budget_ms": STARTUP_BUDGET_MS,
+            "warmup_ms": state.warmup,
+        }
+        if state.startup_error:
+            body.update(error=state.startup_error, startup_attempts=state.startup_attempts)
+        if state.ready:
+            try:
+                check_database()
+            except Exception as e:
+                body.update(ready=False, error=f"database: {e}")
+        return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+    if database.ASYNC_DB:
+        # Imported only here: the async drivers and greenlet are optional
+        from routers import devices_async
+        app.include_router(devices_async.router)
+    else:
+        app.include_router(devices.router)
+    app.include_router(history.router)
+    app.include_router(software.router)
+    app.include_router(usb.router)
+    app.include_router(changes.router)
+    app.include_router(stats.router)
+    app.include_router(search.router)
+    app.include_router(diagnostics.router)
+    return app
+
+app = create_app()
@@ -0,0 +1,142 @@
+"""Brings the database schema up to date with models.py.
+
+Run once per deploy, before starting the API workers:
+
+    python migrate.py
+
+Creates missing tables, adds columns that were introduced after a table was
+created (new NOT NULL columns always carry a server default), and creates
+missing indexes. Newly added promoted hardware columns (hardware_attributes.py)
+are filled from the stored JSON, a new search index (search_index.py) from
+the stored devices, empty device identities become NULL, and devices without
+a detail snapshot get one. New fleet counters (fleet_stats.py) are computed
+from the stored devices. It never drops or alters existing columns.
+"""
+import logging
+from typing import List, Set
+
+from sqlalchemy import bindparam, delete, inspect, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn
+
+import crud, database, hardware_attributes, models, search_index
+from identity_map import IDENTITY_KEYS
+
+logger = logging.getLogger(__name__)
+
+
+def _index_names(connection, inspector, table: str) -> Set[str]:
+    # The inspector skips expression indexes (e.g. ix_devices_name_id), so ask the catalog directly
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        query = "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"
+    elif dialect == "postgresql":
+        query = "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table"
+    else:
+        return {index["name"] for index in inspector.get_indexes(table)}
+    return set(connection.execute(text(query), {"table": table}).scalars())
+
+
+def _applies(index, dialect: str) -> bool:
+    # Indexes declared with ddl_if(dialect=...) only exist on that dialect
+    ddl_if = index._ddl_if
+    return ddl_if is None or ddl_if.dialect in (None, dialect)
+
+
+def backfill_promoted(connection, names: List[str], batch_size: int = 1000) -> int:
+    """Fills the given promoted hardware columns from the JSON sections they are extracted from."""
+    hardware = models.HardwareDetail.__table__
+    sections = sorted({hardware_attributes.PROMOTED[name].section for name in names})
+    stmt = (
+        update(hardware)
+        .where(hardware.c.id == bindparam("row_id"))
+        .values({name: bindparam(name) for name in names})
+    )
+    last_id, filled = 0, 0
+    while True:
+        rows = connection.execute(
+            select(hardware.c.id, *(hardware.c[section] for section in sections))
+            .where(hardware.c.id > last_id)
+            .order_by(hardware.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return filled
+        params = []
+        for row in rows:
+            values = hardware_attributes.extract(row._mapping)
+            params.append({"row_id": row.id, **{name: values[name] for name in names}})
+        connection.execute(stmt, params)
+        filled += len(rows)
+        last_id = rows[-1].id
+
+
+def migrate(engine: Engine = None) -> List[str]:
+    """Applies pending schema changes; returns a description of each one."""
+    engine = engine or database.get_engine()
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    applied = [f"create table {name}" for name in models.Base.metadata.tables if name not in existing_tables]
+    models.Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as connection:
+        # Inspect through this connection: the SQLite writer pool holds a single one
+        inspector = inspect(connection)
+        for table in models.Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {column["name"] for column in inspector.get_columns(table.name)}
+            added = []
+            for column in table.columns:
+                if column.name not in columns:
+                    ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+                    applied.append(f"add column {table.name}.{column.name}")
+                    added.append(column.name)
+            promoted = [name for name in added if table is models.HardwareDetail.__table__ and name in hardware_attributes.PROMOTED]
+            if promoted:
+                filled = backfill_promoted(connection, promoted)
+                applied.append(f"backfill {', '.join(promoted)} ({filled} rows)")
+            indexes = _index_names(connection, inspector, table.name)
+            for index in table.indexes:
+                if index.name not in indexes and _applies(index, connection.dialect.name):
+                    index.create(connection)
+                    applied.append(f"create index {index.name}")
+        # Reports used to store empty identities, which the unique indexes let only one
+        # device hold; their snapshots are dropped to be rendered again below
+        if models.Device.__tablename__ in existing_tables:
+            devices = models.Device.__table__
+            for key in IDENTITY_KEYS:
+                cleared = connection.execute(
+                    update(devices).where(devices.c[key] == "")
+                    .values({key: None, "version": devices.c.version + 1})
+                    .returning(devices.c.id)
+                ).scalars().all()
+                if cleared:
+                    snapshots = models.DeviceSnapshot.__table__
+                    connection.execute(delete(snapshots).where(snapshots.c.device_id.in_(cleared)))
+                    applied.append(f"clear empty devices.{key} ({len(cleared)} rows)")
+        # After the column changes above, which the documents may read
+        if models.DeviceSearch.__tablename__ not in existing_tables and existing_tables:
+            applied.append(f"index {search_index.rebuild(connection)} devices for search")
+
+    # Reads render a missing snapshot on every request without storing it, so
+    # render them here; each carries its device's share of the fleet counters,
+    # which a new fleet_stats table also needs counted over the existing devices
+    with Session(bind=engine) as db:
+        unrendered = db.execute(
+            select(models.Device.id).where(~models.Device.snapshot.has()).limit(1)
+        ).first()
+        new_counters = models.FleetStat.__tablename__ not in existing_tables and existing_tables
+        if unrendered is not None or new_counters:
+            applied.append(f"render snapshots and fleet stats of {crud.rebuild_fleet_stats(db)} devices")
+    return applied
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    changes = migrate()
+    for change in changes:
+        logger.info(change)
+    logger.info("Schema is up to date (%s changes applied)", len(changes))
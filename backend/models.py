@@ -1,23 +1,107 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, JSON
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, JSON, Index, LargeBinary, DDL, event, literal_column
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
+import hardware_attributes
 
 class Device(Base):
     __tablename__ = "devices"
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
+    # Stable agent-reported identity (/etc/machine-id or a hardware hash); preferred
+    # over MAC and IP when matching reports to devices (see identity_map.py)
+    machine_id = Column(String, unique=True, index=True, nullable=True)
     ip_address = Column(String, unique=True, index=True)
     mac_address = Column(String, unique=True, index=True, nullable=True)
     device_type = Column(String, index=True)
-    os = Column(String, nullable=True)
-    status = Column(String, default="unknown")
-    last_seen = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    os = Column(String, nullable=True, index=True)
+    status = Column(String, default="unknown", index=True)
+    # Written by agent reports only (crud.upsert_device, on the application clock);
+    # no onupdate, so version bumps and manual edits leave it alone
+    last_seen = Column(DateTime(timezone=True), server_default=func.now())
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Bumped on every real change to the device, its hardware or its child sections
+    # (not on last_seen heartbeats); backs the ETags of GET /devices/
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     hardware_details = relationship("HardwareDetail", back_populates="device", uselist=False, cascade="all, delete-orphan")
     history_logs = relationship("HistoryLog", back_populates="device", cascade="all, delete-orphan")
+    installed_software = relationship("InstalledSoftware", back_populates="device", cascade="all, delete-orphan")
+    usb_devices = relationship("UsbDevice", back_populates="device", cascade="all, delete-orphan")
+    snapshot = relationship("DeviceSnapshot", uselist=False, cascade="all, delete-orphan")
+    search_document = relationship("DeviceSearch", uselist=False, cascade="all, delete-orphan")
+
+    # (sort key, id) indexes backing keyset pagination of GET /devices/
+    __table_args__ = (
+        Index("ix_devices_name_id", func.coalesce(name, ""), id),
+        Index("ix_devices_ip_address_id", func.coalesce(ip_address, ""), id),
+        Index("ix_devices_last_seen_id", last_seen, id),
+        Index("ix_devices_created_at_id", created_at, id),
+        Index("ix_devices_type_last_seen_id", device_type, last_seen, id),
+        Index("ix_devices_status_last_seen_id", status, last_seen, id),
+    )
+
+class DeviceSnapshot(Base):
+    """GET /devices/{id} response body, rendered once per device version at write time."""
+    __tablename__ = "device_snapshots"
+
+    device_id = Column(Integer, ForeignKey("devices.id"), primary_key=True)
+    version = Column(Integer, nullable=False)
+    body = Column(LargeBinary, nullable=False)
+    # This device's share of the fleet_stats counters at that version (see fleet_stats.py)
+    stats = Column(JSON, nullable=True)
+
+class DeviceSearch(Base):
+    """Search document of a device (see search_index.py), re-rendered with its snapshot."""
+    __tablename__ = "device_search"
+
+    device_id = Column(Integer, ForeignKey("devices.id"), primary_key=True)
+    document = Column(Text, nullable=False)
+
+    __table_args__ = (
+        Index(
+            "ix_device_search_tsv", func.to_tsvector(literal_column("'simple'"), document), postgresql_using="gin"
+        ).ddl_if(dialect="postgresql"),
+    )
+
+# On SQLite the index is an external-content FTS5 table over device_search,
+# kept in sync by triggers; prefix indexes keep per-keystroke lookups cheap
+for _ddl in (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS device_search_fts USING fts5("
+    "document, content='device_search', content_rowid='device_id', prefix='1 2 3')",
+    "CREATE TRIGGER IF NOT EXISTS device_search_ai AFTER INSERT ON device_search BEGIN "
+    "INSERT INTO device_search_fts(rowid, document) VALUES (new.device_id, new.document); END",
+    "CREATE TRIGGER IF NOT EXISTS device_search_ad AFTER DELETE ON device_search BEGIN "
+    "INSERT INTO device_search_fts(device_search_fts, rowid, document) VALUES ('delete', old.device_id, old.document); END",
+    "CREATE TRIGGER IF NOT EXISTS device_search_au AFTER UPDATE ON device_search BEGIN "
+    "INSERT INTO device_search_fts(device_search_fts, rowid, document) VALUES ('delete', old.device_id, old.document); "
+    "INSERT INTO device_search_fts(rowid, document) VALUES (new.device_id, new.document); END",
+):
+    event.listen(DeviceSearch.__table__, "after_create", DDL(_ddl).execute_if(dialect="sqlite"))
+
+class FleetStat(Base):
+    """Incrementally maintained fleet-wide counter, e.g. ("os", "Windows 11") -> 42."""
+    __tablename__ = "fleet_stats"
+
+    metric = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    value = Column(Float, nullable=False, default=0)
+
+class ChangeEvent(Base):
+    """Append-only journal of device mutations, served by GET /changes.
+
+    device_id is deliberately not a foreign key: delete events outlive the device.
+    """
+    __tablename__ = "change_journal"
+
+    id = Column(Integer, primary_key=True)
+    timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    device_id = Column(Integer, nullable=False, index=True)
+    operation = Column(String, nullable=False)  # "create", "update" or "delete"
+    # "device" for the device's own fields, plus the hardware sections that changed
+    sections = Column(JSON, nullable=True)
+    version = Column(Integer, nullable=True)
 
 class HardwareDetail(Base):
     __tablename__ = "hardware_details"
@@ -34,19 +118,76 @@ class HardwareDetail(Base):
     temperature_info = Column(JSON, nullable=True)
     power_supply_info = Column(JSON, nullable=True)
     custom_notes = Column(Text, nullable=True)
+    # Content hash per section above ({"cpu_info": "<hash>", ...}), used to skip
+    # rewriting sections an agent re-reports unchanged
+    section_hashes = Column(JSON, nullable=True)
+    # Bumped on every hardware write; agents send it back as the base of delta reports
+    snapshot_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     device = relationship("Device", back_populates="hardware_details")
 
+# Typed, indexed copies of selected hardware facts, written at ingest (see hardware_attributes.py)
+for _name, _attribute in hardware_attributes.PROMOTED.items():
+    setattr(HardwareDetail, _name, Column(_attribute.type_(), nullable=True, index=True))
+hardware_attributes.json_indexes(HardwareDetail.__table__)
+
+class InstalledSoftware(Base):
+    __tablename__ = "installed_software"
+
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(Integer, ForeignKey("devices.id"), nullable=False)
+    name = Column(String, nullable=False)
+    version = Column(String, nullable=True)
+    publisher = Column(String, nullable=True)
+    install_date = Column(String, nullable=True)
+
+    device = relationship("Device", back_populates="installed_software")
+
+    __table_args__ = (
+        # "which devices have X", in device order
+        Index("ix_installed_software_name_device", name, device_id),
+        # version distribution of X (index-only)
+        Index("ix_installed_software_name_version", name, version, device_id),
+        # per-device diffing and "devices missing X"
+        Index("ix_installed_software_device_name", device_id, name),
+    )
+
+class UsbDevice(Base):
+    __tablename__ = "usb_devices"
+
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(Integer, ForeignKey("devices.id"), nullable=False, index=True)
+    name = Column(String, nullable=False)
+    usb_device_id = Column(String, nullable=True)  # PnP device id reported on Windows
+    status = Column(String, nullable=True)
+
+    device = relationship("Device", back_populates="usb_devices")
+
+    __table_args__ = (
+        Index("ix_usb_devices_name_device", name, device_id),
+    )
+
 class HistoryLog(Base):
     __tablename__ = "history_logs"
 
     id = Column(Integer, primary_key=True, index=True)
     device_id = Column(Integer, ForeignKey("devices.id"))
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
-    component = Column(String, index=True)
+    component = Column(String)
     change_description = Column(Text)
     details_before = Column(Text, nullable=True)
     details_after = Column(Text, nullable=True)
     user = Column(String, nullable=True)
+    # Set by history_retention: number of raw changes a rollup row stands for (1 for a kept single change)
+    rollup_count = Column(Integer, nullable=True)
+
+    device = relationship("Device", back_populates="history_logs")
 
-    device = relationship("Device", back_populates="history_logs")
\ No newline at end of file
+    # Keyset indexes for GET /devices/{id}/history and GET /history; on PostgreSQL
+    # the component/user filters are checked from the index before visiting the heap
+    __table_args__ = (
+        Index("ix_history_logs_device_timestamp_id", device_id, timestamp, id,
+              postgresql_include=["component", "user"]),
+        Index("ix_history_logs_timestamp_id", timestamp, id, postgresql_include=["component", "user"]),
+        Index("ix_history_logs_component_timestamp_id", component, timestamp, id),
+    )
\ No newline at end of file
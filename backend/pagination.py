@@ -0,0 +1,56 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded or does not match the query."""
+
+
+def encode_cursor(key: Any, row_id: int, direction: str = "next", **context) -> str:
+    """Builds an opaque keyset cursor from the sort key and id of a boundary row.
+
+    ``context`` (e.g. sort column and order) is embedded so a cursor cannot be
+    replayed against a differently sorted query.
+    """
+    if isinstance(key, datetime):
+        key = {"dt": key.isoformat()}
+    payload = {"k": key, "id": row_id, "d": direction, **context}
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, key_type: type, **context) -> dict:
+    """Decodes a cursor produced by encode_cursor and checks it matches ``context``.
+
+    ``key_type`` is the Python type of the sort column; a key of any other type is
+    rejected before it reaches SQL. None is accepted as well, since a nullable
+    sort column may hold it.
+    Returns a dict with ``key``, ``id`` and ``direction`` ("next" or "prev").
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        key, row_id, direction = payload["k"], payload["id"], payload["d"]
+        if isinstance(key, dict) and "dt" in key:
+            key = datetime.fromisoformat(key["dt"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor("Malformed cursor") from e
+    if direction not in ("next", "prev") or not _is_a(row_id, int) or not (key is None or _is_a(key, key_type)):
+        raise InvalidCursor("Malformed cursor")
+    for name, value in context.items():
+        if payload.get(name) != value:
+            raise InvalidCursor(f"Cursor was issued for a different {name}")
+    return {"key": key, "id": row_id, "direction": direction}
+
+
+def _is_a(value: Any, type_: type) -> bool:
+    # bool is an int to isinstance, but never a valid key
+    return isinstance(value, type_) and not isinstance(value, bool)
+
+
+def escape_like(value: str, escape: str = "\\") -> str:
+    """Escapes LIKE wildcards so ``value`` matches literally in a prefix search."""
+    return value.replace(escape, escape * 2).replace("%", escape + "%").replace("_", escape + "_")
+
@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable, Iterable
+
+# Dependency tag for anything that can change the device listing
+DEVICES = "devices"
+
+
+def device_tag(device_id: int) -> tuple:
+    """Dependency tag of one device (its detail view)."""
+    return ("device", device_id)
+
+
+class QueryCache:
+    """Bounded LRU/TTL cache for read endpoint responses.
+
+    Every entry records the version of the tags it depends on when it was
+    computed; writers call ``bump`` for the tags they touched and any entry
+    whose recorded versions no longer match is treated as a miss. Versions
+    live in this process only, so with several workers the TTL bounds how long
+    another worker's write can go unseen.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+
+    def bump(self, *tags: Hashable):
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _lookup(self, key: Hashable, tags: tuple):
+        """``(True, value)`` on a hit, else ``(False, tag versions to store the new value with)``."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires, versions = entry
+                if expires <= now:
+                    self._stats["expirations"] += 1
+                    del self._entries[key]
+                elif versions != tuple(self._versions.get(tag, 0) for tag in tags):
+                    self._stats["invalidations"] += 1
+                    del self._entries[key]
+                else:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return True, value
+            self._stats["misses"] += 1
+            # Versions are read before computing, so a write that lands meanwhile
+            # leaves this entry already outdated instead of caching stale data
+            return False, tuple(self._versions.get(tag, 0) for tag in tags)
+
+    def _store(self, key: Hashable, value, versions: tuple):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl, versions)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def get_or_set(self, key: Hashable, tags: Iterable[Hashable], compute: Callable):
+        """Returns the cached value for ``key`` or computes, stores and returns it.
+
+        A computed None means there is nothing to cache and is not stored.
+        """
+        if not self.enabled:
+            return compute()
+        hit, found = self._lookup(key, tuple(tags))
+        if hit:
+            return found
+        value = compute()
+        if value is not None:
+            self._store(key, value, found)
+        return value
+
+    async def get_or_set_async(self, key: Hashable, tags: Iterable[Hashable], compute: Callable[[], Awaitable]):
+        """get_or_set for a coroutine-returning ``compute``."""
+        if not self.enabled:
+            return await compute()
+        hit, found = self._lookup(key, tuple(tags))
+        if hit:
+            return found
+        value = await compute()
+        if value is not None:
+            self._store(key, value, found)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            size = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats.update(
+            enabled=self.enabled,
+            size=size,
+            maxsize=self.maxsize,
+            ttl=self.ttl,
+            hit_ratio=round(stats["hits"] / lookups, 4) if lookups else 0.0,
+        )
+        return stats
+
+
+query_cache = QueryCache(
+    maxsize=int(os.getenv("QUERY_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("QUERY_CACHE_TTL", "30")),
+)
+
+
+def invalidate_devices(device_ids: Iterable[int]):
+    """Marks the listing and the given devices as changed."""
+    query_cache.bump(DEVICES, *(device_tag(device_id) for device_id in device_ids))
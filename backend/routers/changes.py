@@ -0,0 +1,57 @@
+import asyncio
+import os
+import time
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+import crud, schemas, database
+
+router = APIRouter(
+    prefix="/changes",
+    tags=["Changes"],
+)
+
+# How often a long-poll re-reads the journal while waiting for new events
+CHANGES_POLL_INTERVAL = float(os.getenv("CHANGES_POLL_INTERVAL", "0.5"))
+
+# Dependency to get DB session
+def get_db():
+    db = database.SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def _read_changes(db: Session, since: int, limit: int):
+    try:
+        return crud.get_changes(db, since=since, limit=limit + 1)
+    finally:
+        # End the read transaction so the next poll sees newly committed events
+        db.rollback()
+
+@router.get("/", response_model=schemas.ChangeFeed)
+async def read_changes(
+    since: int = Query(0, ge=0, description="next_cursor of the previous response; 0 reads from the beginning"),
+    limit: int = Query(500, ge=1, le=5000),
+    wait: float = Query(0, ge=0, le=60, description="Seconds to wait for new events when there are none (long-poll)"),
+    db: Session = Depends(get_db),
+):
+    """
+    Ordered feed of device create, update and delete events after `since`.
+    Update events list the changed parts: "device" for the device's own fields
+    and the names of changed hardware sections.
+    """
+    deadline = time.monotonic() + wait
+    events = await run_in_threadpool(_read_changes, db, since, limit)
+    while not events and time.monotonic() < deadline:
+        await asyncio.sleep(min(CHANGES_POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+        events = await run_in_threadpool(_read_changes, db, since, limit)
+
+    items = [schemas.ChangeEvent.model_validate(event) for event in events[:limit]]
+    return schemas.ChangeFeed(
+        items=items,
+        next_cursor=items[-1].id if items else since,
+        has_more=len(events) > limit,
+    )
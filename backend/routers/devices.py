@@ -1,9 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from contextlib import contextmanager
+from datetime import datetime
+import asyncio
+import hashlib
+import json
+import os
 import traceback
-from typing import List
+from typing import List, Literal, Optional, Tuple
 
-import crud, models, schemas, database
+import broadcast, crud, export, hardware_attributes, models, schemas, serialization, database
+from pagination import InvalidCursor, decode_cursor, encode_cursor
+from ingest_queue import ingest_queue, async_ingest_enabled
+from query_cache import DEVICES, device_tag, query_cache
+from routers import history
 
 router = APIRouter(
     prefix="/devices",
@@ -11,6 +25,176 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+# Number of NDJSON records upserted per transaction by POST /devices/bulk
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+
+# Seconds between keepalive comments on an idle GET /devices/stream connection
+STREAM_KEEPALIVE = float(os.getenv("STREAM_KEEPALIVE", "15"))
+
+def _seen_stamp(last_seen: Optional[datetime]) -> str:
+    # Heartbeats move last_seen without a new version, and it is part of every body
+    return last_seen.strftime("%Y%m%d%H%M%S%f") if last_seen else "0"
+
+def device_etag(device_id: int, version: int, last_seen: Optional[datetime]) -> str:
+    return f'"{device_id}-{version}-{_seen_stamp(last_seen)}"'
+
+def page_etag(devices: List[models.Device], has_more: bool) -> str:
+    """Strong ETag of a device page: which devices it holds, in order, at which version and last_seen."""
+    state = ",".join(f"{d.id}:{d.version}:{_seen_stamp(d.last_seen)}" for d in devices) + (";more" if has_more else "")
+    return '"p-' + hashlib.blake2b(state.encode(), digest_size=12).hexdigest() + '"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match names ``etag`` (or "*")."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in candidates or etag in candidates
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+def queue_report(device: schemas.DeviceCreate) -> Optional[JSONResponse]:
+    """Queues an agent report when INGEST_MODE=async; returns the 202 answer, or None to write it now."""
+    if not async_ingest_enabled():
+        return None
+    if device.base_snapshot_version is not None:
+        # Queued writes cannot acknowledge a snapshot version, so deltas are refused
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": "Delta reports are not accepted in async ingest mode", "resend": "full"},
+        )
+    if not ingest_queue.submit(device):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Ingest queue is full, retry later",
+            headers={"Retry-After": "5"},
+        )
+    accepted = schemas.IngestAccepted(status="queued", queue_depth=ingest_queue.stats()["depth"])
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=accepted.model_dump())
+
+@contextmanager
+def report_errors():
+    """Turns failures of an agent report write into the HTTP errors agents act on."""
+    try:
+        yield
+    except HTTPException:
+        raise
+    except crud.StaleSnapshotError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": str(e), "resend": "full", "snapshot_version": e.current_version},
+        )
+    except IntegrityError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Device conflicts with an existing device: {str(e.orig)}")
+    except Exception as e:
+        traceback.print_exc()  # Mostra a linha exata e traceback no terminal
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Internal server error: {str(e)}")
+
+async def device_filters(
+    device_type: Optional[str] = None,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    os_filter: Optional[str] = Query(None, alias="os"),
+    name_prefix: Optional[str] = None,
+    last_seen_after: Optional[datetime] = None,
+    last_seen_before: Optional[datetime] = None,
+    hw: List[str] = Query(
+        [], description="Hardware filters, repeatable: a promoted attribute (ram_total_gb<8, cpu_cores>=4) "
+                        "or an object section path (cpu_info.brand=AMD)",
+    ),
+) -> dict:
+    """Device filter query parameters shared by the listing and the export."""
+    try:
+        hardware = tuple(hardware_attributes.parse_filter(expression) for expression in hw)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {
+        "device_type": device_type,
+        "status": status_filter,
+        "os": os_filter,
+        "name_prefix": name_prefix,
+        "last_seen_after": last_seen_after,
+        "last_seen_before": last_seen_before,
+        "hardware": hardware,
+    }
+
+async def page_request(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="next_cursor or prev_cursor of a previous page"),
+    sort: Literal["id", "name", "ip_address", "last_seen", "created_at"] = "id",
+    order: Literal["asc", "desc"] = "asc",
+    with_total: bool = Query(False, description="Include a fast estimate of the number of matching devices"),
+    include: Optional[str] = Query(None, description="Comma-separated extras: hardware, history"),
+    history_limit: int = Query(10, ge=1, le=100, description="Recent history entries per device with include=history"),
+) -> dict:
+    """Validated GET /devices/ paging parameters, with the cursor decoded."""
+    includes = {part.strip() for part in include.split(",")} if include else set()
+    unknown = includes - {"hardware", "history"}
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown include: {', '.join(sorted(unknown))}")
+
+    after, backwards = None, False
+    if cursor:
+        try:
+            position = decode_cursor(cursor, crud.DEVICE_SORT_KEYS[sort].type.python_type, sort=sort, order=order)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        after, backwards = (position["key"], position["id"]), position["direction"] == "prev"
+    return {
+        "limit": limit, "cursor": cursor, "sort": sort, "order": order, "with_total": with_total,
+        "includes": includes, "history_limit": history_limit, "after": after, "backwards": backwards,
+    }
+
+def _page_args(page: dict) -> dict:
+    return dict(sort=page["sort"], descending=page["order"] == "desc", after=page["after"],
+                backwards=page["backwards"], limit=page["limit"])
+
+def page_cache_key(filters: dict, page: dict) -> tuple:
+    includes = page["includes"]
+    return ("devices", page["limit"], page["cursor"], page["sort"], page["order"], tuple(filters.items()),
+            page["with_total"], tuple(sorted(includes)), page["history_limit"] if "history" in includes else None)
+
+def current_page_etag(db: Session, filters: dict, page: dict) -> str:
+    """ETag of the page as it is now, decided from the lean summary rows alone."""
+    devices, has_more = crud.get_devices_page(db, filters, **_page_args(page))
+    return page_etag(devices, has_more)
+
+def render_device_page(db: Session, filters: dict, page: dict) -> Tuple[str, bytes]:
+    """``(ETag, JSON body)`` of a schemas.DevicePage."""
+    includes, sort, order, cursor = page["includes"], page["sort"], page["order"], page["cursor"]
+    devices, has_more = crud.get_devices_page(db, filters, with_hardware="hardware" in includes, **_page_args(page))
+    history = crud.get_recent_history(db, [d.id for d in devices], page["history_limit"]) if "history" in includes else None
+
+    def page_cursor(db_device, direction):
+        return encode_cursor(crud.device_sort_value(db_device, sort), db_device.id, direction, sort=sort, order=order)
+
+    next_cursor = prev_cursor = None
+    if devices:
+        if has_more or page["backwards"]:
+            next_cursor = page_cursor(devices[-1], "next")
+        if cursor and (has_more or not page["backwards"]):
+            prev_cursor = page_cursor(devices[0], "prev")
+    total_estimate = crud.estimate_device_count(db, filters) if page["with_total"] else None
+
+    if serialization.FAST_JSON:
+        body = serialization.device_page(devices, history, next_cursor, prev_cursor, total_estimate)
+    else:
+        items = []
+        for db_device in devices:
+            item = schemas.DeviceListItem.model_validate(db_device)
+            if history is not None:
+                item.recent_history = [schemas.HistoryLog.model_validate(log) for log in history[db_device.id]]
+            items.append(item)
+        body = schemas.DevicePage(items=items, next_cursor=next_cursor, prev_cursor=prev_cursor,
+                                  total_estimate=total_estimate).model_dump_json().encode()
+    return page_etag(devices, has_more), body
+
+def device_history(db: Session, device_id: int, filters: dict, cursor: Optional[str], limit: int,
+                   order: str, include_archive: bool) -> schemas.HistoryPage:
+    if crud.get_device_by_id(db, device_id=device_id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Device not found")
+    return history.history_page(db, {"device_id": device_id, **filters}, cursor, limit, order, include_archive)
+
 # Dependency to get DB session
 def get_db():
     db = database.SessionLocal()
@@ -19,36 +203,222 @@ def get_db():
     finally:
         db.close()
 
-@router.post("/", response_model=schemas.Device, status_code=status.HTTP_201_CREATED)
+@router.post(
+    "/",
+    response_model=schemas.Device,
+    status_code=status.HTTP_201_CREATED,
+    responses={202: {"model": schemas.IngestAccepted, "description": "Queued for writing (INGEST_MODE=async)"}},
+)
 def create_or_update_device_endpoint(device: schemas.DeviceCreate, db: Session = Depends(get_db)):
     """
     Creates a new device or updates an existing one based on IP address.
     This endpoint is typically used by the collection agents.
+    With INGEST_MODE=async the report is only validated and queued, and the
+    endpoint answers 202 before it is written.
+
+    Delta reports (base_snapshot_version set) are answered with 409 and
+    "resend": "full" when the server's snapshot is at another version.
     """
-    try:
-        db_device = crud.create_or_update_device(db=db, device=device)
-        return db_device
-    except Exception as e:
-        traceback.print_exc()  # Mostra a linha exata e traceback no terminal
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Internal server error: {str(e)}")
+    queued = queue_report(device)
+    if queued is not None:
+        return queued
+    with report_errors():
+        body = crud.create_or_update_device(db=db, device=device)
+    return Response(body, status_code=status.HTTP_201_CREATED, media_type="application/json")
+
+@router.post("/bulk", response_model=schemas.BulkIngestResult)
+async def bulk_ingest_devices(request: Request, db: Session = Depends(get_db)):
+    """
+    Creates or updates many devices from a newline-delimited JSON stream.
+    Each line is one DeviceCreate record. Records are parsed as the body arrives
+    and upserted in chunks of BULK_CHUNK_SIZE, one transaction per chunk.
+    """
+    summary = schemas.BulkIngestResult(received=0, created=0, updated=0, failed=0)
+    chunk, chunk_lines = [], []
+
+    async def flush_chunk():
+        try:
+            outcomes = await run_in_threadpool(crud.bulk_upsert_devices, db, chunk)
+        except Exception as e:
+            traceback.print_exc()
+            db.rollback()
+            outcomes = [("error", None, f"Internal server error: {str(e)}")] * len(chunk)
+        for line_no, (outcome, device_id, detail) in zip(chunk_lines, outcomes):
+            record(line_no, outcome, device_id, detail)
+        chunk.clear()
+        chunk_lines.clear()
+
+    def record(line_no, outcome, device_id=None, detail=None):
+        summary.results.append(schemas.BulkItemResult(line=line_no, status=outcome, id=device_id, detail=detail))
+        if outcome == "created":
+            summary.created += 1
+        elif outcome == "updated":
+            summary.updated += 1
+        else:
+            summary.failed += 1
+
+    async def handle_line(line_no, raw):
+        if not raw.strip():
+            return
+        summary.received += 1
+        try:
+            chunk.append(schemas.DeviceCreate.model_validate_json(raw))
+            chunk_lines.append(line_no)
+        except ValidationError as e:
+            record(line_no, "error", detail=str(e))
+            return
+        if len(chunk) >= BULK_CHUNK_SIZE:
+            await flush_chunk()
 
-@router.get("/", response_model=List[schemas.Device])
-def read_devices(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    buffer = b""
+    line_no = 0
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for raw in lines:
+            line_no += 1
+            await handle_line(line_no, raw)
+    if buffer:
+        line_no += 1
+        await handle_line(line_no, buffer)
+    if chunk:
+        await flush_chunk()
+
+    summary.results.sort(key=lambda r: r.line)
+    return summary
+
+@router.get("/", response_model=schemas.DevicePage)
+def read_devices(
+    request: Request,
+    filters: dict = Depends(device_filters),
+    page: dict = Depends(page_request),
+    db: Session = Depends(get_db),
+):
     """
-    Retrieve a list of devices.
+    Retrieve a page of device summaries.
+    Pages are keyset-paginated: pass `next_cursor`/`prev_cursor` from the previous
+    response as `cursor` (with the same sort and order) to move between pages.
+    Hardware details and a bounded slice of recent history are only loaded when
+    requested through `include`; use GET /devices/{device_id} for full details.
+    `hw` filters on hardware specs (e.g. `hw=ram_total_gb<8`) through indexed
+    columns extracted at ingest; see hardware_attributes.py.
+    Pages are served from the query cache until a device write invalidates them,
+    and carry an ETag; with a matching If-None-Match the answer is 304, decided
+    from the lean summary rows alone.
     """
-    devices = crud.get_devices(db, skip=skip, limit=limit)
-    return devices
+    if request.headers.get("if-none-match"):
+        etag = current_page_etag(db, filters, page)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+    etag, body = query_cache.get_or_set(
+        page_cache_key(filters, page), [DEVICES], lambda: render_device_page(db, filters, page)
+    )
+    return Response(body, media_type="application/json", headers={"ETag": etag})
 
-@router.get("/{device_id}", response_model=schemas.Device)
-def read_device(device_id: int, db: Session = Depends(get_db)):
+@router.get("/export", response_class=StreamingResponse)
+def export_devices(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    filters: dict = Depends(device_filters),
+):
+    """
+    Export every matching device, streamed as it is read from the database.
+    NDJSON carries one document per device with its hardware sections; CSV
+    flattens the common hardware fields into columns.
+    """
+    def batches():
+        # The session lives as long as the stream, not the request handler
+        db = database.SessionLocal()
+        try:
+            yield from crud.stream_device_export(db, filters)
+        finally:
+            db.close()
+
+    if format == "csv":
+        return StreamingResponse(
+            export.csv_chunks(batches()), media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="devices.csv"'},
+        )
+    return StreamingResponse(export.ndjson_chunks(batches()), media_type="application/x-ndjson")
+
+@router.get("/stream", response_class=StreamingResponse)
+async def stream_device_changes(request: Request):
+    """
+    Server-Sent Events stream of device changes written by this server.
+    Each `device` event carries the device id, operation, changed sections,
+    version and the new device summary (null for deletes). A client that falls
+    too far behind receives a `resync` event and is disconnected; it should
+    reload its data (or catch up through GET /changes) and reconnect.
+    """
+    subscriber = broadcast.hub.subscribe()
+    if subscriber is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many stream clients",
+                            headers={"Retry-After": "30"})
+
+    async def events():
+        try:
+            yield b"retry: 5000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield b": keepalive\n\n"
+                    continue
+                if event is broadcast.DROPPED:
+                    yield b"event: resync\ndata: {}\n\n"
+                    return
+                yield b"event: device\ndata: " + json.dumps(event, separators=(",", ":")).encode() + b"\n\n"
+        finally:
+            broadcast.hub.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@router.get("/{device_id}", response_model=schemas.Device, responses={304: {"description": "Not modified"}})
+def read_device(device_id: int, request: Request, db: Session = Depends(get_db)):
     """
     Retrieve a specific device by its ID.
+    The body is the snapshot pre-rendered when the device last changed, so no ORM
+    or validation work happens here. The ETag carries the device version and
+    last_seen (which heartbeats move); a matching If-None-Match is answered with
+    304 after a single primary-key lookup.
     """
-    db_device = crud.get_device_by_id(db, device_id=device_id)
-    if db_device is None:
+    current = crud.get_device_version(db, device_id)
+    if current is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Device not found")
-    return db_device
+    version, last_seen = current
+    etag = device_etag(device_id, version, last_seen)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    # The version in the key also catches writes made by other worker processes
+    body = query_cache.get_or_set(
+        ("device", device_id, version), [device_tag(device_id)],
+        lambda: crud.get_device_snapshot(db, device_id, version),
+    )
+    if body is None:
+        # Written again (or deleted) since its version was read; answer from the newer state
+        return read_device(device_id, request, db)
+    return Response(serialization.with_last_seen(body, last_seen), media_type="application/json", headers={"ETag": etag})
+
+@router.get("/{device_id}/history", response_model=schemas.HistoryPage)
+def read_device_history(
+    device_id: int,
+    component: Optional[str] = Query(None, description="Hardware section, e.g. disk_info or installed_software"),
+    user: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    order: Literal["asc", "desc"] = "desc",
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    include_archive: bool = Query(False, description="Also read rows moved to the compressed archive"),
+    db: Session = Depends(get_db),
+):
+    """
+    Change history of one device within an optional time range, newest first by default.
+    """
+    filters = {"component": component, "user": user, "since": since, "until": until}
+    return device_history(db, device_id, filters, cursor, limit, order, include_archive)
 
 @router.put("/{device_id}", response_model=schemas.Device)
 def update_device_endpoint(device_id: int, device_update: schemas.DeviceUpdate, db: Session = Depends(get_db)):
@@ -56,10 +426,10 @@ def update_device_endpoint(device_id: int, device_update: schemas.DeviceUpdate,
     Manually update specific fields of a device.
     This endpoint is typically used by the frontend for user edits.
     """
-    db_device = crud.update_device_manual(db=db, device_id=device_id, device_update=device_update)
-    if db_device is None:
+    body = crud.update_device_manual(db=db, device_id=device_id, device_update=device_update)
+    if body is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Device not found")
-    return db_device
+    return Response(body, media_type="application/json")
 
 @router.delete("/{device_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_device_endpoint(device_id: int, db: Session = Depends(get_db)):
@@ -71,9 +441,3 @@ def delete_device_endpoint(device_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Device not found")
     return
 
-# Add endpoints for history logs if needed
-# Example:
-# @router.post("/{device_id}/history", response_model=schemas.HistoryLog, status_code=status.HTTP_201_CREATED)
-# def create_history_log_for_device(...):
-#     ...
-
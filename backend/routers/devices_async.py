@@ -0,0 +1,148 @@
+"""The /devices router on AsyncSession, served instead of routers.devices when DB_ASYNC=true.
+
+Same paths, parameters and responses as the sync router, whose helpers it
+reuses; only the database access differs. The bulk ingest, export and live
+stream endpoints are shared with the sync router as they are.
+"""
+from datetime import datetime
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import async_crud, database, schemas, serialization
+from query_cache import DEVICES, device_tag, query_cache
+from routers import devices
+
+router = APIRouter(
+    prefix="/devices",
+    tags=["Devices"],
+    responses={404: {"description": "Not found"}},
+)
+
+# Registered first so /export and /stream are matched before /{device_id}
+SHARED_PATHS = {"/devices/bulk", "/devices/export", "/devices/stream"}
+router.routes.extend(route for route in devices.router.routes if route.path in SHARED_PATHS)
+
+# Dependency to get DB session
+async def get_db():
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
+@router.post(
+    "/",
+    response_model=schemas.Device,
+    status_code=status.HTTP_201_CREATED,
+    responses={202: {"model": schemas.IngestAccepted, "description": "Queued for writing (INGEST_MODE=async)"}},
+)
+async def create_or_update_device_endpoint(device: schemas.DeviceCreate, db: AsyncSession = Depends(get_db)):
+    """
+    Creates a new device or updates an existing one based on IP address.
+    This endpoint is typically used by the collection agents.
+    With INGEST_MODE=async the report is only validated and queued, and the
+    endpoint answers 202 before it is written.
+
+    Delta reports (base_snapshot_version set) are answered with 409 and
+    "resend": "full" when the server's snapshot is at another version.
+    """
+    queued = devices.queue_report(device)
+    if queued is not None:
+        return queued
+    with devices.report_errors():
+        body = await async_crud.create_or_update_device(db, device)
+    return Response(body, status_code=status.HTTP_201_CREATED, media_type="application/json")
+
+@router.get("/", response_model=schemas.DevicePage)
+async def read_devices(
+    request: Request,
+    filters: dict = Depends(devices.device_filters),
+    page: dict = Depends(devices.page_request),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Retrieve a page of device summaries.
+    Pages are keyset-paginated: pass `next_cursor`/`prev_cursor` from the previous
+    response as `cursor` (with the same sort and order) to move between pages.
+    Hardware details and a bounded slice of recent history are only loaded when
+    requested through `include`; use GET /devices/{device_id} for full details.
+    `hw` filters on hardware specs (e.g. `hw=ram_total_gb<8`) through indexed
+    columns extracted at ingest; see hardware_attributes.py.
+    Pages are served from the query cache until a device write invalidates them,
+    and carry an ETag; with a matching If-None-Match the answer is 304, decided
+    from the lean summary rows alone.
+    """
+    if request.headers.get("if-none-match"):
+        etag = await db.run_sync(devices.current_page_etag, filters, page)
+        if devices.etag_matches(request, etag):
+            return devices.not_modified(etag)
+    etag, body = await query_cache.get_or_set_async(
+        devices.page_cache_key(filters, page), [DEVICES],
+        lambda: db.run_sync(devices.render_device_page, filters, page),
+    )
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+@router.get("/{device_id}", response_model=schemas.Device, responses={304: {"description": "Not modified"}})
+async def read_device(device_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Retrieve a specific device by its ID.
+    The body is the snapshot pre-rendered when the device last changed, so no ORM
+    or validation work happens here. The ETag carries the device version and
+    last_seen (which heartbeats move); a matching If-None-Match is answered with
+    304 after a single primary-key lookup.
+    """
+    current = await async_crud.get_device_version(db, device_id)
+    if current is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Device not found")
+    version, last_seen = current
+    etag = devices.device_etag(device_id, version, last_seen)
+    if devices.etag_matches(request, etag):
+        return devices.not_modified(etag)
+
+    body = await query_cache.get_or_set_async(
+        ("device", device_id, version), [device_tag(device_id)],
+        lambda: async_crud.get_device_snapshot(db, device_id, version),
+    )
+    if body is None:
+        # Written again (or deleted) since its version was read; answer from the newer state
+        return await read_device(device_id, request, db)
+    return Response(serialization.with_last_seen(body, last_seen), media_type="application/json", headers={"ETag": etag})
+
+@router.get("/{device_id}/history", response_model=schemas.HistoryPage)
+async def read_device_history(
+    device_id: int,
+    component: Optional[str] = Query(None, description="Hardware section, e.g. disk_info or installed_software"),
+    user: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    order: Literal["asc", "desc"] = "desc",
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    include_archive: bool = Query(False, description="Also read rows moved to the compressed archive"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Change history of one device within an optional time range, newest first by default.
+    """
+    filters = {"component": component, "user": user, "since": since, "until": until}
+    return await db.run_sync(devices.device_history, device_id, filters, cursor, limit, order, include_archive)
+
+@router.put("/{device_id}", response_model=schemas.Device)
+async def update_device_endpoint(device_id: int, device_update: schemas.DeviceUpdate, db: AsyncSession = Depends(get_db)):
+    """
+    Manually update specific fields of a device.
+    This endpoint is typically used by the frontend for user edits.
+    """
+    body = await async_crud.update_device_manual(db, device_id, device_update)
+    if body is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Device not found")
+    return Response(body, media_type="application/json")
+
+@router.delete("/{device_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_device_endpoint(device_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    Delete a device by its ID.
+    """
+    if not await async_crud.delete_device(db, device_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Device not found")
+    return
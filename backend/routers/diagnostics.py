@@ -0,0 +1,46 @@
+from fastapi import APIRouter
+
+import broadcast, database
+from identity_map import identity_map
+from ingest_queue import ingest_queue
+from query_cache import query_cache
+
+router = APIRouter(
+    prefix="/diagnostics",
+    tags=["Diagnostics"],
+)
+
+@router.get("/ingest")
+def read_ingest_stats():
+    """
+    Queue depth, throughput and flush latency of the write-behind ingest queue.
+    """
+    return ingest_queue.stats()
+
+@router.get("/cache")
+def read_cache_stats():
+    """
+    Hit, miss and eviction counters of the read endpoint query cache.
+    """
+    return query_cache.stats()
+
+@router.get("/identity")
+def read_identity_stats():
+    """
+    Size and hit/miss counters of the in-process device identity map.
+    """
+    return identity_map.stats()
+
+@router.get("/stream")
+def read_stream_stats():
+    """
+    Connected clients and delivered/dropped counters of GET /devices/stream.
+    """
+    return broadcast.hub.stats()
+
+@router.get("/database")
+def read_database_stats():
+    """
+    Engine profile, size and checkout wait times of each database connection pool.
+    """
+    return database.pool_stats()
@@ -0,0 +1,64 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import Literal, Optional
+
+import crud, schemas, database, history_retention
+from pagination import InvalidCursor, decode_cursor, encode_cursor
+
+router = APIRouter(
+    prefix="/history",
+    tags=["History"],
+)
+
+# Dependency to get DB session
+def get_db():
+    db = database.SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def history_page(db: Session, filters: dict, cursor: Optional[str], limit: int, order: str,
+                 include_archive: bool = False) -> schemas.HistoryPage:
+    """Runs a keyset-paginated history query; shared with GET /devices/{id}/history.
+
+    With ``include_archive`` the archived segments are merged into the same keyset order.
+    """
+    after = None
+    if cursor:
+        try:
+            position = decode_cursor(cursor, datetime, order=order)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        after = (position["key"], position["id"])
+
+    ascending = order == "asc"
+    rows = crud.get_history_page(db, filters, after=after, limit=limit, ascending=ascending)
+    if include_archive:
+        rows += history_retention.read_archive(filters, after=after, limit=limit, ascending=ascending)
+        rows.sort(key=lambda row: (history_retention.naive_utc(row.timestamp), row.id), reverse=not ascending)
+    page = schemas.HistoryPage(items=[schemas.HistoryLog.model_validate(row) for row in rows[:limit]])
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        page.next_cursor = encode_cursor(last.timestamp, last.id, order=order)
+    return page
+
+@router.get("/", response_model=schemas.HistoryPage)
+def read_history(
+    device_id: Optional[int] = None,
+    component: Optional[str] = Query(None, description="Hardware section, e.g. disk_info or installed_software"),
+    user: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    order: Literal["asc", "desc"] = "desc",
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    include_archive: bool = Query(False, description="Also read rows moved to the compressed archive"),
+    db: Session = Depends(get_db),
+):
+    """
+    Fleet-wide change history, newest first by default, keyset-paginated.
+    """
+    filters = {"device_id": device_id, "component": component, "user": user, "since": since, "until": until}
+    return history_page(db, filters, cursor, limit, order, include_archive)
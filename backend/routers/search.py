@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import Response
+from sqlalchemy.orm import Session
+from typing import Literal
+
+import crud, schemas, search_index, database
+
+router = APIRouter(
+    prefix="/search",
+    tags=["Search"],
+)
+
+# Dependency to get DB session
+def get_db():
+    db = database.SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+@router.get("/", response_model=schemas.SearchResults)
+def search_devices(
+    q: str = Query(..., min_length=1, max_length=200, description="Words to find, e.g. fin-app*, 10.0.3 or quadro"),
+    mode: Literal["fulltext", "prefix"] = Query(
+        "fulltext", description="prefix: autocomplete, the last word matches as a prefix and results are not ranked"
+    ),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """
+    Find devices by name, OS, IP/MAC address, machine ID, hardware brands, models
+    and serial numbers, or installed software names.
+    Every word must match; a word ending in `*` matches as a prefix. Full-text
+    results are ranked by relevance; prefix mode answers with the first matches,
+    cheap enough to run on every keystroke.
+    """
+    phrases = search_index.parse_query(q, prefix=mode == "prefix")
+    if not phrases:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="q has no searchable words")
+    devices = crud.search_devices(db, phrases, ranked=mode == "fulltext", limit=limit)
+    # Rendered here, while this thread still holds the session: FastAPI would serialize
+    # ORM objects in another threadpool task, which never runs once every thread waits
+    # for a connection
+    results = schemas.SearchResults(items=[schemas.DeviceSummary.model_validate(device) for device in devices])
+    return Response(results.model_dump_json(), media_type="application/json")
@@ -0,0 +1,92 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session
+from typing import List, Optional
+
+import crud, schemas, database
+from pagination import InvalidCursor, decode_cursor, encode_cursor
+
+router = APIRouter(
+    prefix="/software",
+    tags=["Software"],
+)
+
+# Dependency to get DB session
+def get_db():
+    db = database.SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def _after(cursor: Optional[str], **context):
+    if not cursor:
+        return None
+    try:
+        position = decode_cursor(cursor, int, **context)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return position["key"], position["id"]
+
+@router.get("/versions", response_model=List[schemas.SoftwareVersionCount])
+def read_software_versions(name: str, db: Session = Depends(get_db)):
+    """
+    Version distribution of a package: how many devices run each installed version.
+    """
+    return [
+        schemas.SoftwareVersionCount(version=version, device_count=count)
+        for version, count in crud.get_software_versions(db, name)
+    ]
+
+@router.get("/devices", response_model=schemas.SoftwareInstallPage)
+def read_devices_with_software(
+    name: str,
+    version: Optional[str] = Query(None, description="Exact version"),
+    version_lt: Optional[str] = Query(None, description="Only versions lower than this one, e.g. 3 for openssl < 3"),
+    version_gte: Optional[str] = Query(None, description="Only versions equal to or higher than this one"),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Devices that have a package installed, optionally restricted to a version or version range.
+    """
+    versions = None
+    if version is not None:
+        versions = [version]
+    elif version_lt is not None or version_gte is not None:
+        versions = crud.matching_software_versions(db, name, version_lt=version_lt, version_gte=version_gte)
+
+    rows = crud.get_software_installs(db, name, versions=versions, after=_after(cursor, q=name), limit=limit)
+    page = schemas.SoftwareInstallPage(items=[
+        schemas.SoftwareInstall(
+            device_id=db_device.id,
+            device_name=db_device.name,
+            ip_address=db_device.ip_address,
+            name=install.name,
+            version=install.version,
+            publisher=install.publisher,
+            install_date=install.install_date,
+        )
+        for install, db_device in rows[:limit]
+    ])
+    if len(rows) > limit:
+        last_install = rows[limit - 1][0]
+        page.next_cursor = encode_cursor(last_install.device_id, last_install.id, q=name)
+    return page
+
+@router.get("/missing", response_model=schemas.DevicePage)
+def read_devices_missing_software(
+    name: str,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Devices that do not have a package installed.
+    """
+    after = _after(cursor, q=name)
+    devices = crud.get_devices_missing_software(db, name, after_id=after[1] if after else None, limit=limit)
+    page = schemas.DevicePage(items=[schemas.DeviceListItem.model_validate(d) for d in devices[:limit]])
+    if len(devices) > limit:
+        page.next_cursor = encode_cursor(devices[limit - 1].id, devices[limit - 1].id, q=name)
+    return page
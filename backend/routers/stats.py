@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+import crud, fleet_stats, schemas, database
+
+router = APIRouter(
+    prefix="/stats",
+    tags=["Stats"],
+)
+
+# Dependency to get DB session
+def get_db():
+    db = database.SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+@router.get("/", response_model=schemas.FleetStats)
+def read_fleet_stats(db: Session = Depends(get_db)):
+    """
+    Fleet summary for dashboards: devices by OS, type and status, total RAM and
+    devices low on disk space. Read from counters kept up to date on every write,
+    so the cost does not depend on the fleet size.
+    """
+    return fleet_stats.summarize(crud.get_fleet_stats(db))
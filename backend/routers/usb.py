@@ -0,0 +1,55 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session
+from typing import Optional
+
+import crud, schemas, database
+from pagination import InvalidCursor, decode_cursor, encode_cursor
+
+router = APIRouter(
+    prefix="/usb-devices",
+    tags=["USB Devices"],
+)
+
+# Dependency to get DB session
+def get_db():
+    db = database.SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+@router.get("/devices", response_model=schemas.UsbAttachmentPage)
+def read_devices_with_usb(
+    name: str,
+    prefix: bool = Query(False, description="Match USB device names starting with `name`"),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Devices that have a USB device attached.
+    """
+    after = None
+    if cursor:
+        try:
+            position = decode_cursor(cursor, int, q=name, prefix=prefix)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        after = (position["key"], position["id"])
+
+    rows = crud.get_usb_attachments(db, name, exact=not prefix, after=after, limit=limit)
+    page = schemas.UsbAttachmentPage(items=[
+        schemas.UsbAttachment(
+            device_id=db_device.id,
+            device_name=db_device.name,
+            ip_address=db_device.ip_address,
+            name=usb.name,
+            usb_device_id=usb.usb_device_id,
+            status=usb.status,
+        )
+        for usb, db_device in rows[:limit]
+    ])
+    if len(rows) > limit:
+        last_usb = rows[limit - 1][0]
+        page.next_cursor = encode_cursor(last_usb.device_id, last_usb.id, q=name, prefix=prefix)
+    return page
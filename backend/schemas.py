@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import Optional, List, Dict, Any, Union
 from datetime import datetime
 
 class HardwareDetailBase(BaseModel):
@@ -14,11 +14,15 @@ class HardwareDetailBase(BaseModel):
     custom_notes: Optional[str] = None
 
 class HardwareDetailCreate(HardwareDetailBase):
-    pass
+    # Reported by agents but stored in the normalized installed_software and
+    # usb_devices tables rather than on hardware_details
+    installed_software: Optional[List[Dict[str, Any]]] = None
+    usb_devices: Optional[List[Union[str, Dict[str, Any]]]] = None
 
 class HardwareDetail(HardwareDetailBase):
     id: int
     device_id: int
+    snapshot_version: int = 0
 
     class Config:
         from_attributes = True
@@ -29,6 +33,7 @@ class HistoryLogBase(BaseModel):
     details_before: Optional[str] = None
     details_after: Optional[str] = None
     user: Optional[str] = None
+    rollup_count: Optional[int] = None
 
 class HistoryLogCreate(HistoryLogBase):
     pass
@@ -41,16 +46,58 @@ class HistoryLog(HistoryLogBase):
     class Config:
         from_attributes = True
 
+class HistoryPage(BaseModel):
+    items: List[HistoryLog]
+    next_cursor: Optional[str] = None
+
+class ChangeEvent(BaseModel):
+    id: int
+    timestamp: datetime
+    device_id: int
+    operation: str  # "create", "update" or "delete"
+    sections: Optional[List[str]] = None
+    version: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+class ChangeFeed(BaseModel):
+    items: List[ChangeEvent]
+    # Pass back as `since` to resume after the last event returned
+    next_cursor: int
+    has_more: bool = False
+
 class DeviceBase(BaseModel):
     name: Optional[str] = None
-    ip_address: str
+    # Stored devices can lose their IP to another machine (crud.release_identities)
+    ip_address: Optional[str] = None
     mac_address: Optional[str] = None
+    machine_id: Optional[str] = None
     device_type: Optional[str] = Field(default="unknown")
     os: Optional[str] = None
     status: Optional[str] = Field(default="online")
 
 class DeviceCreate(DeviceBase):
     hardware_details: Optional[HardwareDetailCreate] = None
+    # Delta reports: hardware_details only carries the sections that changed since
+    # this acknowledged snapshot version (see HardwareDetail.snapshot_version)
+    base_snapshot_version: Optional[int] = None
+
+    @field_validator("machine_id", "mac_address", "ip_address", mode="before")
+    @classmethod
+    def blank_identity_to_none(cls, value):
+        # Identities are unique columns: an empty string would be one more value
+        # shared by every device that reports it
+        if isinstance(value, str) and not value.strip():
+            return None
+        return value
+
+    @model_validator(mode="after")
+    def check_identity(self):
+        # Reports are matched to devices by these keys (see identity_map.py)
+        if not (self.machine_id or self.mac_address or self.ip_address):
+            raise ValueError("A report needs a non-empty machine_id, mac_address or ip_address to identify its device")
+        return self
 
 class DeviceUpdate(BaseModel):
     name: Optional[str] = None
@@ -61,12 +108,96 @@ class DeviceUpdate(BaseModel):
     status: Optional[str] = None
     hardware_details: Optional[HardwareDetailCreate] = None
 
+    @field_validator("mac_address", "ip_address", mode="before")
+    @classmethod
+    def blank_identity_to_none(cls, value):
+        return DeviceCreate.blank_identity_to_none(value)
+
+class DeviceSummary(DeviceBase):
+    id: int
+    last_seen: datetime
+    created_at: datetime
+    version: int = 1
+
+    class Config:
+        from_attributes = True
+
+class SearchResults(BaseModel):
+    items: List[DeviceSummary]
+
+class DeviceListItem(DeviceSummary):
+    # Only filled in when requested with GET /devices/?include=hardware,history
+    hardware_details: Optional[HardwareDetail] = None
+    recent_history: Optional[List[HistoryLog]] = None
+
+class DevicePage(BaseModel):
+    items: List[DeviceListItem]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    total_estimate: Optional[int] = None
+
 class Device(DeviceBase):
     id: int
     last_seen: datetime
     created_at: datetime
+    version: int = 1
     hardware_details: Optional[HardwareDetail] = None
     history_logs: List[HistoryLog] = []
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class FleetStats(BaseModel):
+    devices: int
+    by_os: Dict[str, int]
+    by_device_type: Dict[str, int]
+    by_status: Dict[str, int]
+    ram_total_gb: float
+    # Devices with at least one disk or partition under 10% free space
+    low_disk_devices: int
+
+class BulkItemResult(BaseModel):
+    line: int
+    status: str  # "created", "updated", "stale" or "error"
+    id: Optional[int] = None
+    detail: Optional[str] = None
+
+class BulkIngestResult(BaseModel):
+    received: int
+    created: int
+    updated: int
+    failed: int
+    results: List[BulkItemResult] = []
+
+class IngestAccepted(BaseModel):
+    status: str
+    queue_depth: int
+
+class SoftwareInstall(BaseModel):
+    device_id: int
+    device_name: Optional[str] = None
+    ip_address: Optional[str] = None
+    name: str
+    version: Optional[str] = None
+    publisher: Optional[str] = None
+    install_date: Optional[str] = None
+
+class SoftwareInstallPage(BaseModel):
+    items: List[SoftwareInstall]
+    next_cursor: Optional[str] = None
+
+class SoftwareVersionCount(BaseModel):
+    version: Optional[str] = None
+    device_count: int
+
+class UsbAttachment(BaseModel):
+    device_id: int
+    device_name: Optional[str] = None
+    ip_address: Optional[str] = None
+    name: str
+    usb_device_id: Optional[str] = None
+    status: Optional[str] = None
+
+class UsbAttachmentPage(BaseModel):
+    items: List[UsbAttachment]
+    next_cursor: Optional[str] = None
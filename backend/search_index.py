@@ -0,0 +1,131 @@
+"""Full-text search documents behind GET /search.
+
+Each device has one search document (the device_search table): its name, OS,
+type and addresses, the brands, models and serial numbers found in its hardware
+sections, and the names of its installed software, reduced to lowercase word
+tokens. It is re-rendered with the device snapshot whenever the device changes.
+
+The index over it is an FTS5 table kept in sync by triggers on SQLite and a GIN
+index on ``to_tsvector('simple', document)`` on PostgreSQL (see
+models.DeviceSearch). Queries match every word of ``q``; a word is a phrase of
+its tokens, so "10.0.0" or "fin-app" match addresses and hyphenated names. A
+word ending in ``*`` and, in prefix mode, the last word match as prefixes.
+Run ``python search_index.py`` to rebuild every document.
+"""
+import re
+from collections import defaultdict
+from typing import Iterable, List, Tuple
+
+from sqlalchemy import delete, insert, select
+
+import models
+
+DEVICE_FIELDS = ("name", "ip_address", "mac_address", "machine_id", "os", "device_type")
+HARDWARE_SECTIONS = ("cpu_info", "gpu_info", "motherboard_info", "ram_info", "disk_info", "network_info", "power_supply_info")
+# Keys whose values are worth finding a device by, at any depth of a hardware section
+TEXT_KEYS = {
+    "brand", "model", "manufacturer", "vendor", "product", "name", "serial", "serial_number",
+    "part_number", "mac_address", "ip_address",
+}
+# Bounds on what a single query may ask for
+MAX_WORDS = 8
+MAX_TOKEN_LENGTH = 64
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokens(text: str) -> List[str]:
+    return [token[:MAX_TOKEN_LENGTH] for token in _TOKEN.findall(text.lower())]
+
+
+def _hardware_text(value, out: list, depth: int = 0):
+    if depth > 3:
+        return
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in TEXT_KEYS and isinstance(item, (str, int)) and not isinstance(item, bool):
+                out.append(str(item))
+            elif isinstance(item, (dict, list)):
+                _hardware_text(item, out, depth + 1)
+    elif isinstance(value, list):
+        for item in value:
+            _hardware_text(item, out, depth + 1)
+
+
+def document(device, hardware, software_names: Iterable[str]) -> str:
+    """Search document of a device; ``device`` and ``hardware`` are ORM objects or rows."""
+    parts = [str(getattr(device, field)) for field in DEVICE_FIELDS if getattr(device, field, None)]
+    if hardware is not None:
+        for section in HARDWARE_SECTIONS:
+            _hardware_text(getattr(hardware, section, None), parts)
+    parts.extend(dict.fromkeys(name for name in software_names if name))
+    return " ".join(token for part in parts for token in tokens(part))
+
+
+def parse_query(q: str, prefix: bool = False) -> List[Tuple[List[str], bool]]:
+    """``(tokens, is_prefix)`` phrases of a query, every one of which must match."""
+    words = q.split()[:MAX_WORDS]
+    phrases = []
+    for position, word in enumerate(words):
+        word_tokens = tokens(word)
+        if word_tokens:
+            phrases.append((word_tokens, word.endswith("*") or (prefix and position == len(words) - 1)))
+    return phrases
+
+
+def match_expression(dialect: str, phrases: List[Tuple[List[str], bool]]) -> str:
+    """The phrases as an FTS5 MATCH string or a PostgreSQL tsquery. Tokens are \\w+ only, so nothing needs escaping."""
+    if dialect == "postgresql":
+        return " & ".join(
+            "(" + " <-> ".join(words[:-1] + [words[-1] + (":*" if is_prefix else "")]) + ")"
+            for words, is_prefix in phrases
+        )
+    return " ".join('"' + " ".join(words) + '"' + ("*" if is_prefix else "") for words, is_prefix in phrases)
+
+
+def software_names(connection, device_ids: List[int]) -> dict:
+    software = models.InstalledSoftware.__table__
+    names = defaultdict(list)
+    rows = connection.execute(
+        select(software.c.device_id, software.c.name).where(software.c.device_id.in_(device_ids)).order_by(software.c.id)
+    )
+    for device_id, name in rows:
+        names[device_id].append(name)
+    return names
+
+
+def rebuild(connection, batch_size: int = 1000) -> int:
+    """Re-renders every device's search document; returns the number of devices."""
+    devices = models.Device.__table__
+    hardware = models.HardwareDetail.__table__
+    search = models.DeviceSearch.__table__
+    connection.execute(delete(search))
+    last_id = 0
+    count = 0
+    while True:
+        rows = connection.execute(
+            select(devices.c.id, *(devices.c[field] for field in DEVICE_FIELDS),
+                   *(hardware.c[section] for section in HARDWARE_SECTIONS))
+            .outerjoin(hardware, hardware.c.device_id == devices.c.id)
+            .where(devices.c.id > last_id)
+            .order_by(devices.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return count
+        names = software_names(connection, [row.id for row in rows])
+        connection.execute(insert(search), [
+            {"device_id": row.id, "document": document(row, row, names[row.id])} for row in rows
+        ])
+        count += len(rows)
+        last_id = rows[-1].id
+
+
+if __name__ == "__main__":
+    import logging
+
+    import database
+
+    logging.basicConfig(level=logging.INFO)
+    with database.get_engine().begin() as connection:
+        logging.getLogger(__name__).info("Rebuilt the search index of %s devices", rebuild(connection))
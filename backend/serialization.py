@@ -0,0 +1,92 @@
+"""Opt-in fast JSON rendering of device responses (FAST_JSON=true).
+
+Data read from the database does not need to be validated again on the way
+out, so instead of building pydantic models (model_validate, which re-checks
+every nested hardware blob) and dumping them, the fast path copies the fields of
+the response schemas straight off the ORM objects into plain dicts and encodes
+them with orjson, or pydantic-core's serializer when orjson is not installed.
+The output is the same JSON document, with the same keys in the same order, but
+not always the same bytes: orjson spells some floats differently (``1e20``
+where pydantic writes ``1e+20``). Snapshots rendered after FAST_JSON is toggled
+can therefore differ in bytes from older ones while parsing to equal values;
+nothing compares bodies by bytes (ETags come from versions).
+Run ``python bench/json_serialization.py`` to compare both paths.
+"""
+import os
+import re
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from pydantic import TypeAdapter
+from pydantic_core import to_json
+
+import schemas
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FAST_JSON = os.getenv("FAST_JSON", "false").lower() in ("1", "true", "yes")
+
+# Field lists of the response schemas, resolved once at import
+SUMMARY_FIELDS = tuple(schemas.DeviceSummary.model_fields)
+HARDWARE_FIELDS = tuple(schemas.HardwareDetail.model_fields)
+HISTORY_FIELDS = tuple(schemas.HistoryLog.model_fields)
+
+LAST_SEEN_FIELD = re.compile(rb'"last_seen":"[^"]*"')
+_datetime_json = TypeAdapter(datetime)
+
+
+def dumps(value) -> bytes:
+    if orjson is not None:
+        # OPT_UTC_Z matches pydantic's "Z" suffix for UTC datetimes
+        return orjson.dumps(value, option=orjson.OPT_UTC_Z)
+    return to_json(value)
+
+
+def with_last_seen(body: bytes, last_seen: datetime) -> bytes:
+    """Swaps the current last_seen into a pre-rendered device body.
+
+    Heartbeat reports only move last_seen and do not re-render the snapshot. The
+    first "last_seen" key in the body is the device's own: it precedes the nested
+    objects, and quotes inside string values are always escaped.
+    """
+    return LAST_SEEN_FIELD.sub(b'"last_seen":' + _datetime_json.dump_json(last_seen), body, count=1)
+
+
+def _fields(obj, fields) -> Optional[dict]:
+    if obj is None:
+        return None
+    return {field: getattr(obj, field) for field in fields}
+
+
+def _history(logs) -> List[dict]:
+    return [_fields(log, HISTORY_FIELDS) for log in logs]
+
+
+def device_list_item(db_device, history: Optional[list] = None) -> dict:
+    """schemas.DeviceListItem as a dict; hardware is included when it was loaded."""
+    item = _fields(db_device, SUMMARY_FIELDS)
+    item["hardware_details"] = _fields(db_device.hardware_details, HARDWARE_FIELDS)
+    item["recent_history"] = _history(history) if history is not None else None
+    return item
+
+
+def device_page(devices, history: Optional[Dict[int, list]], next_cursor: Optional[str],
+                prev_cursor: Optional[str], total_estimate: Optional[int]) -> bytes:
+    """JSON body of schemas.DevicePage."""
+    return dumps({
+        "items": [device_list_item(d, history[d.id] if history is not None else None) for d in devices],
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "total_estimate": total_estimate,
+    })
+
+
+def device_detail(db_device) -> bytes:
+    """JSON body of schemas.Device."""
+    body = _fields(db_device, SUMMARY_FIELDS)
+    body["hardware_details"] = _fields(db_device.hardware_details, HARDWARE_FIELDS)
+    body["history_logs"] = _history(db_device.history_logs)
+    return dumps(body)
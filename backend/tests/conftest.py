@@ -0,0 +1,28 @@
+import os
+import sys
+import tempfile
+
+# The backend modules import each other flatly and read DATABASE_URL at import
+# time, so the path and a throwaway database are set up before any of them loads.
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+_DB_DIR = tempfile.mkdtemp(prefix="inventory-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_DB_DIR, 'inventory.db')}"
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="session")
+def app():
+    import main
+    import migrate
+
+    migrate.migrate()
+    return main.app
+
+
+@pytest.fixture(scope="session")
+def client(app):
+    with TestClient(app, raise_server_exceptions=False) as test_client:
+        yield test_client
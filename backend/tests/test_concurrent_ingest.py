@@ -0,0 +1,62 @@
+"""Concurrent agent reports for the same device must never fail with a 500."""
+import threading
+from collections import Counter
+
+THREADS = 16
+POSTS_PER_THREAD = 30
+
+
+def test_concurrent_reports_for_one_device(client):
+    codes = Counter()
+    lock = threading.Lock()
+    barrier = threading.Barrier(THREADS)
+
+    def agent(n):
+        barrier.wait()
+        for i in range(POSTS_PER_THREAD):
+            response = client.post("/devices/", json={
+                "name": f"stress-{n}",
+                "ip_address": "10.250.0.1",
+                "mac_address": "02:00:00:00:fa:01",
+                "hardware_details": {"cpu_info": {"model": "stress", "cores": i}},
+            })
+            with lock:
+                codes[response.status_code] += 1
+
+    threads = [threading.Thread(target=agent, args=(n,)) for n in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert codes == {201: THREADS * POSTS_PER_THREAD}
+    matching = [d for d in client.get("/devices/", params={"limit": 1000}).json()["items"]
+                if d["ip_address"] == "10.250.0.1"]
+    assert len(matching) == 1
+
+
+def test_concurrent_reports_moving_between_addresses(client):
+    """Reports of one MAC from changing IPs race with reports of the IPs' own owners."""
+    codes = Counter()
+    lock = threading.Lock()
+    barrier = threading.Barrier(THREADS)
+
+    def agent(n):
+        barrier.wait()
+        for i in range(POSTS_PER_THREAD):
+            response = client.post("/devices/", json={
+                "name": f"roaming-{n}",
+                "ip_address": f"10.251.0.{(n + i) % 4}",
+                "mac_address": f"02:00:00:00:fb:{n % 2:02x}",
+            })
+            with lock:
+                codes[response.status_code] += 1
+
+    threads = [threading.Thread(target=agent, args=(n,)) for n in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert codes[500] == 0
+    assert sum(codes.values()) == THREADS * POSTS_PER_THREAD
@@ -0,0 +1,31 @@
+"""ETags must change whenever the body does, heartbeats included."""
+
+REPORT = {"name": "etag-host", "ip_address": "10.254.0.1", "mac_address": "02:00:00:00:fe:01",
+          "hardware_details": {"cpu_info": {"model": "etag", "cores": 2}}}
+
+
+def test_detail_etag_follows_heartbeats(client):
+    device_id = client.post("/devices/", json=REPORT).json()["id"]
+    first = client.get(f"/devices/{device_id}")
+    etag = first.headers["ETag"]
+    assert client.get(f"/devices/{device_id}", headers={"If-None-Match": etag}).status_code == 304
+
+    # Same report again: a heartbeat, which moves only last_seen
+    client.post("/devices/", json=REPORT)
+    after = client.get(f"/devices/{device_id}", headers={"If-None-Match": etag})
+    assert after.status_code == 200
+    assert after.json()["version"] == first.json()["version"]
+    assert after.json()["last_seen"] != first.json()["last_seen"]
+    assert client.get(f"/devices/{device_id}", headers={"If-None-Match": after.headers["ETag"]}).status_code == 304
+
+
+def test_page_etag_follows_heartbeats(client):
+    client.post("/devices/", json=REPORT)
+    params = {"name_prefix": "etag-"}
+    etag = client.get("/devices/", params=params).headers["ETag"]
+    assert client.get("/devices/", params=params, headers={"If-None-Match": etag}).status_code == 304
+
+    client.post("/devices/", json=REPORT)
+    after = client.get("/devices/", params=params, headers={"If-None-Match": etag})
+    assert after.status_code == 200
+    assert after.headers["ETag"] != etag
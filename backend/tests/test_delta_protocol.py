@@ -0,0 +1,48 @@
+"""Delta reports against an outdated snapshot must leave the device untouched."""
+import json
+
+
+def _report(**fields):
+    report = {"name": "delta-host", "ip_address": "10.252.0.1", "mac_address": "02:00:00:00:fc:01",
+              "status": "online", "hardware_details": {"cpu_info": {"model": "delta", "cores": 4}}}
+    report.update(fields)
+    return report
+
+
+def _latest_change(client):
+    cursor = 0
+    while True:
+        feed = client.get("/changes/", params={"since": cursor, "limit": 1000}).json()
+        cursor = feed["next_cursor"]
+        if not feed["has_more"]:
+            return cursor
+
+
+def test_stale_bulk_delta_writes_nothing(client):
+    created = client.post("/devices/", json=_report())
+    assert created.status_code == 201
+    device = created.json()
+    snapshot_version = device["hardware_details"]["snapshot_version"]
+    latest_change = _latest_change(client)
+
+    stale = _report(name="renamed", status="offline", base_snapshot_version=snapshot_version - 1,
+                    hardware_details={"ram_info": {"total_gb": 32}})
+    response = client.post("/devices/bulk", content=json.dumps(stale) + "\n",
+                           headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert [item["status"] for item in response.json()["results"]] == ["stale"]
+
+    after = client.get(f"/devices/{device['id']}").json()
+    assert (after["name"], after["status"], after["version"]) == ("delta-host", "online", device["version"])
+    assert client.get("/changes/", params={"since": latest_change}).json()["items"] == []
+
+
+def test_stale_single_delta_is_refused(client):
+    device = client.post("/devices/", json=_report(ip_address="10.252.0.2", mac_address="02:00:00:00:fc:02")).json()
+    stale = _report(ip_address="10.252.0.2", mac_address="02:00:00:00:fc:02", name="renamed",
+                    base_snapshot_version=device["hardware_details"]["snapshot_version"] - 1,
+                    hardware_details={"ram_info": {"total_gb": 32}})
+    response = client.post("/devices/", json=stale)
+    assert response.status_code == 409
+    assert response.json()["detail"]["resend"] == "full"
+    assert client.get(f"/devices/{device['id']}").json()["name"] == "delta-host"
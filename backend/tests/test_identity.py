@@ -0,0 +1,86 @@
+"""Reports are matched to devices by machine_id, then MAC, then IP."""
+import json
+
+
+def test_report_without_identity_is_rejected(client):
+    response = client.post("/devices/", json={"name": "anonymous", "ip_address": ""})
+    assert response.status_code == 422
+    assert "machine_id, mac_address or ip_address" in response.text
+
+
+def test_empty_ip_with_a_mac_is_accepted(client):
+    report = {"name": "mac-only", "ip_address": "", "mac_address": "02:00:00:00:ff:01"}
+    first = client.post("/devices/", json=report)
+    assert first.status_code == 201
+    again = client.post("/devices/", json=report)
+    assert again.status_code == 201
+    assert again.json()["id"] == first.json()["id"]
+
+
+def test_devices_without_an_ip_do_not_share_one(client):
+    reports = [{"name": "no-ip-a", "ip_address": "", "mac_address": "02:00:00:00:ff:02"},
+               {"name": "no-ip-b", "ip_address": "  ", "mac_address": "02:00:00:00:ff:03", "machine_id": ""}]
+    responses = [client.post("/devices/", json=report) for report in reports]
+    assert [response.status_code for response in responses] == [201, 201]
+    assert responses[0].json()["id"] != responses[1].json()["id"]
+    assert [(response.json()["ip_address"], response.json()["machine_id"]) for response in responses] == [(None, None)] * 2
+
+
+def test_bulk_record_without_identity_fails_alone(client):
+    lines = [{"name": "anonymous", "ip_address": ""}, {"name": "bulk-ok", "ip_address": "10.254.2.1"}]
+    response = client.post("/devices/bulk", content="\n".join(json.dumps(line) for line in lines),
+                           headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert [item["status"] for item in response.json()["results"]] == ["error", "created"]
+
+
+def test_machine_id_wins_over_a_changed_ip(client):
+    report = {"name": "roamer", "ip_address": "10.254.2.10", "machine_id": "machine-roamer"}
+    device_id = client.post("/devices/", json=report).json()["id"]
+    moved = client.post("/devices/", json={**report, "ip_address": "10.254.2.11"})
+    assert moved.json()["id"] == device_id
+    assert moved.json()["ip_address"] == "10.254.2.11"
+
+
+def test_known_devices_can_swap_leases(client):
+    first = {"name": "lease-a", "ip_address": "10.254.2.20", "mac_address": "02:00:00:00:ff:20"}
+    second = {"name": "lease-b", "ip_address": "10.254.2.21", "mac_address": "02:00:00:00:ff:21"}
+    first_id = client.post("/devices/", json=first).json()["id"]
+    second_id = client.post("/devices/", json=second).json()["id"]
+
+    swapped = client.post("/devices/", json={**first, "ip_address": "10.254.2.21"})
+    assert swapped.status_code == 201
+    assert (swapped.json()["id"], swapped.json()["ip_address"]) == (first_id, "10.254.2.21")
+    # The other machine lost the lease until its own next report
+    released = client.get(f"/devices/{second_id}").json()
+    assert released["ip_address"] is None
+    assert released["version"] > 1
+    assert second_id in [device["id"] for device in client.get("/devices/", params={"sort": "ip_address", "limit": 1000}).json()["items"]]
+
+    swapped = client.post("/devices/", json={**second, "ip_address": "10.254.2.20"})
+    assert swapped.status_code == 201
+    assert (swapped.json()["id"], swapped.json()["ip_address"]) == (second_id, "10.254.2.20")
+
+
+def test_mac_only_device_takes_over_an_ip_held_by_another_machine(client):
+    holder = client.post("/devices/", json={"name": "lease-holder", "ip_address": "10.254.2.30",
+                                            "mac_address": "02:00:00:00:ff:30"}).json()
+    mover = {"name": "lease-mover", "ip_address": "10.254.2.31", "mac_address": "02:00:00:00:ff:31"}
+    mover_id = client.post("/devices/", json=mover).json()["id"]
+
+    moved = client.post("/devices/", json={**mover, "ip_address": "10.254.2.30"})
+    assert moved.status_code == 201
+    assert moved.json()["id"] == mover_id
+    assert client.get(f"/devices/{holder['id']}").json()["ip_address"] is None
+
+
+def test_bulk_lease_swap_is_written(client):
+    first = {"name": "bulk-lease-a", "ip_address": "10.254.2.40", "machine_id": "machine-bulk-lease-a"}
+    second = {"name": "bulk-lease-b", "ip_address": "10.254.2.41", "machine_id": "machine-bulk-lease-b"}
+    ids = [client.post("/devices/", json=report).json()["id"] for report in (first, second)]
+
+    lines = [{**first, "ip_address": "10.254.2.41"}, {**second, "ip_address": "10.254.2.40"}]
+    response = client.post("/devices/bulk", content="\n".join(json.dumps(line) for line in lines),
+                           headers={"Content-Type": "application/x-ndjson"})
+    assert [item["status"] for item in response.json()["results"]] == ["updated", "updated"]
+    assert [client.get(f"/devices/{device_id}").json()["ip_address"] for device_id in ids] == ["10.254.2.41", "10.254.2.40"]
@@ -0,0 +1,28 @@
+"""A queued batch the database keeps refusing is retried, then split, before anything is dropped."""
+from sqlalchemy.exc import OperationalError
+
+
+def test_failing_batch_is_retried_then_written_one_report_at_a_time(app, monkeypatch):
+    import crud
+    import schemas
+    from ingest_queue import IngestQueue
+
+    bulk_upsert_devices = crud.bulk_upsert_devices
+    calls = []
+
+    def flaky_bulk_upsert(db, devices):
+        calls.append(len(devices))
+        # Whole batches always fail; so does the one report the database cannot take
+        if len(devices) > 1 or devices[0].name == "queue-poison":
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return bulk_upsert_devices(db, devices)
+
+    monkeypatch.setattr(crud, "bulk_upsert_devices", flaky_bulk_upsert)
+    batch = [schemas.DeviceCreate(name=name, ip_address=f"10.254.3.{i}")
+             for i, name in enumerate(["queue-a", "queue-poison", "queue-b"], start=1)]
+    ingest = IngestQueue(retries=2, retry_delay=0)
+    ingest._flush(batch)
+
+    assert calls == [3, 3, 3, 1, 1, 1]
+    stats = ingest.stats()
+    assert (stats["written"], stats["failed"], stats["dropped"], stats["retries"]) == (2, 0, 1, 2)
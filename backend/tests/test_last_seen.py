@@ -0,0 +1,37 @@
+"""last_seen is written on one clock, whatever else the report changes."""
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def local_time_behind_utc(monkeypatch):
+    # UTC-3 without needing tzdata: local and database (UTC) clocks now disagree
+    monkeypatch.setenv("TZ", "BRT3")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_hardware_change_keeps_last_seen_on_the_report_clock(client, local_time_behind_utc):
+    report = {"name": "clock-host", "ip_address": "10.254.1.1", "hardware_details": {"ram_info": {"total_gb": 8}}}
+    device_id = client.post("/devices/", json=report).json()["id"]
+    seen = [datetime.fromisoformat(client.get(f"/devices/{device_id}").json()["last_seen"])]
+
+    report["hardware_details"]["ram_info"]["total_gb"] = 16
+    client.post("/devices/", json=report)
+    seen.append(datetime.fromisoformat(client.get(f"/devices/{device_id}").json()["last_seen"]))
+    client.post("/devices/", json=report)
+    seen.append(datetime.fromisoformat(client.get(f"/devices/{device_id}").json()["last_seen"]))
+
+    assert seen == sorted(seen)
+    assert seen[-1] - seen[0] < timedelta(minutes=1)
+
+
+def test_manual_edit_does_not_move_last_seen(client):
+    device = client.post("/devices/", json={"name": "edit-host", "ip_address": "10.254.1.2"}).json()
+    edited = client.put(f"/devices/{device['id']}", json={"name": "renamed"}).json()
+    assert edited["version"] > device["version"]
+    assert edited["last_seen"] == device["last_seen"]
@@ -0,0 +1,39 @@
+"""Cursors are opaque to clients, but a forged one must answer 400, never 500."""
+import base64
+import json
+
+import pytest
+
+
+def _cursor(payload: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("sort, key", [
+    ("id", [1, 2]),
+    ("id", "7"),
+    ("id", True),
+    ("name", {"a": 1}),
+    ("ip_address", 3),
+    ("last_seen", {"dt": [2024]}),
+    ("last_seen", "2024-01-01"),
+])
+def test_forged_cursor_key_is_rejected(client, sort, key):
+    cursor = _cursor({"k": key, "id": 1, "d": "next", "sort": sort, "order": "asc"})
+    response = client.get("/devices/", params={"sort": sort, "cursor": cursor})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Malformed cursor"
+
+
+def test_forged_cursor_id_is_rejected(client):
+    cursor = _cursor({"k": 1, "id": [1], "d": "next", "sort": "id", "order": "asc"})
+    assert client.get("/devices/", params={"cursor": cursor}).status_code == 400
+
+
+def test_issued_cursor_pages_through(client):
+    for n in range(3):
+        client.post("/devices/", json={"name": f"page-{n}", "ip_address": f"10.253.0.{n}"})
+    first = client.get("/devices/", params={"sort": "last_seen", "limit": 1}).json()
+    second = client.get("/devices/", params={"sort": "last_seen", "limit": 1, "cursor": first["next_cursor"]})
+    assert second.status_code == 200
+    assert second.json()["items"][0]["id"] != first["items"][0]["id"]
@@ -0,0 +1,67 @@
+"""Device detail reads never write, and never serve a body under another version."""
+from sqlalchemy import delete, func, select, update
+
+
+def snapshot_count(device_id: int) -> int:
+    import database
+    import models
+
+    with database.get_engine().connect() as connection:
+        return connection.execute(
+            select(func.count()).select_from(models.DeviceSnapshot).where(models.DeviceSnapshot.device_id == device_id)
+        ).scalar()
+
+
+def test_missing_snapshot_is_rendered_without_writing_until_migrate(client):
+    import crud
+    import database
+    import migrate
+    import models
+
+    report = {"name": "unrendered-host", "ip_address": "10.254.4.1", "hardware_details": {"ram_info": {"total_gb": 8}}}
+    device = client.post("/devices/", json=report).json()
+    stats = client.get("/stats").json()
+    with database.get_engine().begin() as connection:
+        connection.execute(delete(models.DeviceSnapshot).where(models.DeviceSnapshot.device_id == device["id"]))
+
+    with database.SessionLocal() as db:
+        body = crud.get_device_snapshot(db, device["id"], device["version"])
+    assert body == client.get(f"/devices/{device['id']}").content
+    assert snapshot_count(device["id"]) == 0
+    assert client.get("/stats").json() == stats
+
+    assert any(change.startswith("render snapshots") for change in migrate.migrate())
+    assert snapshot_count(device["id"]) == 1
+    assert client.get("/stats").json() == stats
+
+
+def test_snapshot_at_another_version_is_not_served(client):
+    import crud
+    import database
+
+    report = {"name": "moving-host", "ip_address": "10.254.4.2", "hardware_details": {"ram_info": {"total_gb": 8}}}
+    first = client.post("/devices/", json=report).json()
+    report["hardware_details"]["ram_info"]["total_gb"] = 16
+    second = client.post("/devices/", json=report).json()
+    assert second["version"] > first["version"]
+
+    with database.SessionLocal() as db:
+        assert crud.get_device_snapshot(db, first["id"], first["version"]) is None
+        assert crud.get_device_snapshot(db, first["id"], second["version"]) is not None
+
+
+def test_migrate_counts_existing_devices_into_a_new_fleet_stats_table(client):
+    import database
+    import migrate
+    import models
+
+    client.post("/devices/", json={"name": "counted-host", "ip_address": "10.254.4.3"})
+    stats = client.get("/stats").json()
+    # As left by a version without fleet counters
+    models.FleetStat.__table__.drop(database.get_engine())
+    with database.get_engine().begin() as connection:
+        connection.execute(update(models.DeviceSnapshot).values(stats=None))
+
+    migrate.migrate()
+    assert client.get("/stats").json() == stats
+    assert stats["devices"] > 0
@@ -0,0 +1,41 @@
+"""A worker whose first startup preparation fails must still become ready."""
+import asyncio
+import time
+from types import SimpleNamespace
+
+
+def test_prepare_retries_until_warmup_succeeds(app, monkeypatch):
+    import database
+    import main
+    import warmup
+
+    attempts = []
+
+    def flaky_warm_up(connections):
+        attempts.append(connections)
+        if len(attempts) < 3:
+            raise ConnectionError("database unreachable\ndetails")
+        return {"connections": 1.0}
+
+    monkeypatch.setattr(warmup, "warm_up", flaky_warm_up)
+    monkeypatch.setattr(database, "ASYNC_DB", False)
+    monkeypatch.setattr(main, "AUTO_MIGRATE", False)
+    monkeypatch.setattr(main, "STARTUP_RETRY_DELAY", 0.01)
+    state = SimpleNamespace(ready=False, startup_ms=None, startup_error=None, startup_attempts=0, warmup=None)
+
+    asyncio.run(main.prepare(SimpleNamespace(state=state)))
+
+    assert len(attempts) == 3
+    assert state.ready and state.startup_attempts == 3
+    assert state.startup_error is None
+    assert state.warmup == {"connections": 1.0}
+
+
+def test_readyz_once_warm(client):
+    # Warmup runs in the background after startup
+    for _ in range(100):
+        response = client.get("/readyz")
+        if response.status_code == 200:
+            break
+        time.sleep(0.1)
+    assert response.json()["ready"] is True
@@ -0,0 +1,23 @@
+"""POST and PUT answer with the same body GET /devices/{id} serves right after."""
+
+
+def test_write_responses_match_the_detail_body(client):
+    report = {"name": "echo-host", "ip_address": "10.254.5.1", "hardware_details": {"ram_info": {"total_gb": 8}}}
+    created = client.post("/devices/", json=report)
+    assert created.status_code == 201
+    device_id = created.json()["id"]
+    assert created.content == client.get(f"/devices/{device_id}").content
+
+    # Heartbeat: served from the stored snapshot with the new last_seen
+    heartbeat = client.post("/devices/", json=report)
+    assert heartbeat.json()["last_seen"] != created.json()["last_seen"]
+    assert heartbeat.content == client.get(f"/devices/{device_id}").content
+
+    report["hardware_details"]["ram_info"]["total_gb"] = 16
+    changed = client.post("/devices/", json=report)
+    assert changed.json()["hardware_details"]["ram_info"] == {"total_gb": 16}
+    assert changed.content == client.get(f"/devices/{device_id}").content
+
+    edited = client.put(f"/devices/{device_id}", json={"name": "echo-renamed"})
+    assert edited.json()["name"] == "echo-renamed"
+    assert edited.content == client.get(f"/devices/{device_id}").content
@@ -0,0 +1,114 @@
+"""Startup warmup, run by the lifespan hook before /readyz reports ready.
+
+Pays the one-off costs that would otherwise land on the first requests a new
+worker serves: opening database connections, configuring the ORM mappers and
+compiling the hot read queries (SQLAlchemy caches compiled statements), and the
+first pass through the pydantic validators/serializers of the device schemas.
+Nothing is written to the database or the query cache.
+"""
+import logging
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+from sqlalchemy.orm import configure_mappers
+
+import crud, database, schemas, serialization
+
+logger = logging.getLogger(__name__)
+
+_SAMPLE_TIME = datetime(2024, 1, 1, tzinfo=timezone.utc)
+_SAMPLE_HISTORY = {
+    "id": 1, "device_id": 1, "timestamp": _SAMPLE_TIME, "component": "hardware",
+    "change_description": "warmup", "details_before": None, "details_after": None, "user": "agent",
+}
+_SAMPLE_DEVICE = {
+    "id": 1, "name": "warmup", "ip_address": "192.0.2.1", "mac_address": "00:00:5e:00:53:01",
+    "device_type": "desktop", "os": "Linux", "status": "online", "last_seen": _SAMPLE_TIME,
+    "created_at": _SAMPLE_TIME, "version": 1,
+    "hardware_details": {
+        "id": 1, "device_id": 1, "cpu_info": {"model": "warmup", "cores": 4}, "ram_info": {"total_gb": 8},
+        "disk_info": [{"device": "sda", "total_gb": 100, "free_gb": 50}], "network_info": [{"name": "eth0"}],
+    },
+}
+
+
+def open_connections(count: int):
+    """Checks out ``count`` pooled connections at once so the pool holds them ready,
+    plus the writer connection when the profile has a separate one."""
+    engines = [database.get_read_engine()]
+    if database.get_engine() is not engines[0]:
+        engines.append(database.get_engine())
+    connections = []
+    try:
+        for engine in engines:
+            for _ in range(max(count, 1) if engine is engines[0] else 1):
+                connection = engine.connect()
+                connection.execute(text("SELECT 1"))
+                connections.append(connection)
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+async def open_async_connections(count: int) -> float:
+    """open_connections for the DB_ASYNC pools; returns the time it took, in milliseconds."""
+    started = time.perf_counter()
+    engines = [database.get_async_read_engine()]
+    if database.get_async_engine() is not engines[0]:
+        engines.append(database.get_async_engine())
+    connections = []
+    try:
+        for engine in engines:
+            for _ in range(max(count, 1) if engine is engines[0] else 1):
+                connection = await engine.connect()
+                await connection.execute(text("SELECT 1"))
+                connections.append(connection)
+    finally:
+        for connection in connections:
+            await connection.close()
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def prime_queries():
+    """Runs the hot read paths once (limit 1) so their statements are compiled and cached."""
+    configure_mappers()
+    db = database.SessionLocal()
+    try:
+        devices, _ = crud.get_devices_page(db, {}, limit=1, with_hardware=True)
+        crud.get_recent_history(db, [device.id for device in devices], 1)
+        crud.estimate_device_count(db, {})
+        crud.get_fleet_stats(db)
+        crud.get_latest_change_id(db)
+        if devices:
+            crud.get_device_version(db, devices[0].id)
+    finally:
+        db.close()
+
+
+def prime_schemas():
+    """Validates and serializes a sample through each response and request schema."""
+    device = schemas.Device.model_validate({**_SAMPLE_DEVICE, "history_logs": [_SAMPLE_HISTORY]})
+    device.model_dump_json()
+    schemas.DevicePage(
+        items=[schemas.DeviceListItem.model_validate({**_SAMPLE_DEVICE, "recent_history": [_SAMPLE_HISTORY]})]
+    ).model_dump_json()
+    schemas.HistoryPage(items=[schemas.HistoryLog.model_validate(_SAMPLE_HISTORY)]).model_dump_json()
+    schemas.DeviceCreate.model_validate_json(device.model_dump_json(exclude={"id", "history_logs"}))
+    if serialization.FAST_JSON:
+        serialization.dumps(device.model_dump())
+
+
+def warm_up(connections: int) -> dict:
+    """Runs every warmup step; returns the time each one took, in milliseconds."""
+    timings = {}
+    for name, step in (
+        ("connections", lambda: open_connections(connections)),
+        ("queries", prime_queries),
+        ("schemas", prime_schemas),
+    ):
+        started = time.perf_counter()
+        step()
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info("Warmup done: %s", timings)
+    return timings
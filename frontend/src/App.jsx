@@ -1,30 +1,81 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import './App.css';
 import DeviceDetail from './DeviceDetail';
 
+// Order of the list as requested from the API (sort=name): by name, then id
+function compareDevices(a, b) {
+  const nameA = a.name || '';
+  const nameB = b.name || '';
+  if (nameA !== nameB) {
+    return nameA < nameB ? -1 : 1;
+  }
+  return a.id - b.id;
+}
+
+// Applies one event from GET /devices/stream to the loaded device list.
+// A new device is only inserted when it falls inside the loaded pages (or all
+// pages are loaded); otherwise a later "load more" page brings it.
+function applyDeviceChange(devices, change, allLoaded) {
+  if (change.operation === 'delete') {
+    return devices.filter(device => device.id !== change.device_id);
+  }
+  if (devices.some(device => device.id === change.device_id)) {
+    return devices.map(device => (device.id === change.device_id ? { ...device, ...change.device } : device));
+  }
+  if (change.operation !== 'create') {
+    return devices;
+  }
+  const position = devices.findIndex(device => compareDevices(change.device, device) < 0);
+  if (position === -1) {
+    return allLoaded ? [...devices, change.device] : devices;
+  }
+  return [...devices.slice(0, position), change.device, ...devices.slice(position)];
+}
+
+// Appends a fetched page, skipping devices the list already shows
+function appendPage(devices, items) {
+  const loaded = new Set(devices.map(device => device.id));
+  return [...devices, ...items.filter(item => !loaded.has(item.id))];
+}
+
 function DeviceList() {
   const [devices, setDevices] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [selectedDevice, setSelectedDevice] = useState(null);
 
-  useEffect(() => {
-    // Fetch devices from the backend API
-    // Ensure the backend API is running and accessible
-    // Adjust the URL if the backend is running elsewhere
-    const apiUrl = '/api/devices/'; // Using relative path for proxy (needs setup) or direct URL
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  // Read by the stream handler, which is set up once
+  const allLoaded = useRef(false);
+
+  // Fetch one page of devices from the backend API (keyset pagination)
+  // Ensure the backend API is running and accessible
+  // Adjust the URL if the backend is running elsewhere
+  const fetchPage = (cursor) => {
+    const params = new URLSearchParams({ limit: '100', sort: 'name' });
+    if (cursor) {
+      params.set('cursor', cursor);
+    }
+    const apiUrl = `/api/devices/?${params}`; // Using relative path for proxy (needs setup) or direct URL
 
-    fetch(apiUrl)
+    return fetch(apiUrl)
       .then(response => {
         if (!response.ok) {
           throw new Error(`HTTP error! status: ${response.status}`);
         }
         return response.json();
       })
-      .then(data => {
-        setDevices(data);
-        setLoading(false);
-      })
+      .then(page => {
+        setDevices(previous => (cursor ? appendPage(previous, page.items) : page.items));
+        setNextCursor(page.next_cursor);
+        allLoaded.current = !page.next_cursor;
+      });
+  };
+
+  useEffect(() => {
+    fetchPage(null)
+      .then(() => setLoading(false))
       .catch(error => {
         console.error("Error fetching devices:", error);
         setError(error.message);
@@ -32,8 +83,44 @@ function DeviceList() {
       });
   }, []); // Empty dependency array means this effect runs once on mount
 
+  useEffect(() => {
+    // Live updates pushed by the backend instead of polling the list
+    const source = new EventSource('/api/devices/stream');
+    source.addEventListener('device', (message) => {
+      const change = JSON.parse(message.data);
+      setDevices(previous => applyDeviceChange(previous, change, allLoaded.current));
+    });
+    // Sent when this client fell behind; reload and let EventSource reconnect
+    source.addEventListener('resync', () => {
+      fetchPage(null).catch(error => console.error("Error refreshing devices:", error));
+    });
+    return () => source.close();
+  }, []);
+
+  const handleLoadMore = () => {
+    setLoadingMore(true);
+    fetchPage(nextCursor)
+      .catch(error => {
+        console.error("Error fetching devices:", error);
+        setError(error.message);
+      })
+      .finally(() => setLoadingMore(false));
+  };
+
   const handleDeviceClick = (device) => {
-    setSelectedDevice(device);
+    // The list only carries device summaries; fetch hardware details on demand
+    fetch(`/api/devices/${device.id}`)
+      .then(response => {
+        if (!response.ok) {
+          throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        return response.json();
+      })
+      .then(data => setSelectedDevice(data))
+      .catch(error => {
+        console.error("Error fetching device details:", error);
+        setSelectedDevice(device);
+      });
   };
 
   const handleCloseDetail = () => {
@@ -73,7 +160,7 @@ function DeviceList() {
               <tr key={device.id} className="device-row">
                 <td>{device.id}</td>
                 <td>{device.name || 'N/A'}</td>
-                <td>{device.ip_address}</td>
+                <td>{device.ip_address || 'N/A'}</td>
                 <td>{device.mac_address || 'N/A'}</td>
                 <td>{device.device_type}</td>
                 <td>{device.os || 'N/A'}</td>
@@ -92,6 +179,12 @@ function DeviceList() {
           </tbody>
         </table>
       )}
+
+      {nextCursor && (
+        <button className="load-more-button" onClick={handleLoadMore} disabled={loadingMore}>
+          {loadingMore ? 'Carregando...' : 'Carregar mais'}
+        </button>
+      )}
       
       {selectedDevice && (
         <DeviceDetail 
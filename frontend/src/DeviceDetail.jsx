@@ -37,7 +37,7 @@ function DeviceDetail({ device, onClose }) {
                 </tr>
                 <tr>
                   <td>Endereço IP:</td>
-                  <td>{device.ip_address}</td>
+                  <td>{device.ip_address || 'N/A'}</td>
                 </tr>
                 <tr>
                   <td>Endereço MAC:</td>